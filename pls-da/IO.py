@@ -38,8 +38,12 @@ if __name__ == '__main__':
     raise SystemExit('Please do not run that script, load it!')
 
 
-def dump(workspace, split, sample):
-    """Save the informations necessary to rebuild the model."""
+def dump(workspace, split, sample, plan=None):
+    """Save the informations necessary to rebuild the model.
+
+       The model.SplitPlan of the cross-validation, if any, is saved too
+       and can be loaded by load_split_plan().
+    """
     folder = os.path.abspath(workspace)
     if not os.path.isdir(folder):
         raise FileNotFoundError('Directory {} does not exist'.format(folder))
@@ -50,12 +54,18 @@ def dump(workspace, split, sample):
     matrix.insert(0, train_set.header)
     save_matrix(matrix, filename=os.path.join(folder, 'dataset.csv'))
 
-    data = {'nr_lv': plot.MODEL.nr_lv, 'centered': train_set.centered,
+    data = {'nr_lv': plot.MODEL.nr_lv, 'engine': plot.MODEL.engine,
+            'centered': train_set.centered,
             'normalized': train_set.normalized,
             'split': split, 'sample': sample}
     with open(os.path.join(folder, 'data.yaml'), 'w') as f:
         yaml.safe_dump(data, f)
 
+    if plan is not None:
+        np.savez(os.path.join(folder, 'split_plan.npz'), n=plan.n,
+                 indices=np.concatenate(plan.tests),
+                 sizes=[len(test) for test in plan.tests])
+
 
 def save_matrix(matrix, filename, header='', scientific_notation=False):
     """Save on CSV the specified matrix."""
@@ -68,9 +78,12 @@ def save_matrix(matrix, filename, header='', scientific_notation=False):
                ';', header=header)
 
 
-def load(workspace):
+def load(workspace, engine=None):
     """Load from workspace the informations necessary to rebuild the model.
 
+       The model is rebuilt with the given engine (see model.ENGINES) or,
+       if it is None, with the one saved in the workspace.
+
        Return: (plsda_model, train_set, split, samples)
     """
     folder = os.path.abspath(workspace)
@@ -86,10 +99,24 @@ def load(workspace):
     if data['normalized']:
         dataset.normalize()
 
-    nipals_model = model.nipals(dataset.x, dataset.y)
-    nipals_model.nr_lv = data['nr_lv']
+    if engine is None:
+        engine = data.get('engine', 'nipals')
+
+    plsda_model = model.fit(dataset.x, dataset.y, engine=engine)
+    plsda_model.nr_lv = data['nr_lv']
+
+    return plsda_model, dataset, data['split'], data['sample']
+
 
-    return nipals_model, dataset, data['split'], data['sample']
+def load_split_plan(workspace):
+    """Return the model.SplitPlan saved by dump() in workspace, None if
+       there is not any."""
+    filename = os.path.join(os.path.abspath(workspace), 'split_plan.npz')
+    if not os.path.isfile(filename):
+        return None
+    with np.load(filename) as data:
+        tests = np.split(data['indices'], np.cumsum(data['sizes'])[:-1])
+        return model.SplitPlan(int(data['n']), tests)
 
 
 def mat2str(data, h_bar='-', v_bar='|', join='+'):
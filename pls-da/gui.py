@@ -26,6 +26,7 @@ __license__ = "GPL3"
 
 import copy
 import enum
+import os
 import traceback
 import matplotlib.pyplot as plt
 import numpy as np
@@ -190,6 +191,22 @@ def popup_choose_item(message, item_list, parent, title=None):
     return ok_answer, item_list.index(dialog.textValue())
 
 
+def popup_input_text(message, parent, title=None):
+    """Display a dialog to insert a line of text.
+
+       Return tuple with two values:
+         True on Ok answer, False otherwise
+         the inserted text.
+    """
+    dialog = QInputDialog(parent)
+    dialog.setObjectName('popup_input_text')
+    dialog.setWindowTitle(title if title is not None else '')
+    dialog.setLabelText(message)
+    dialog.setInputMode(QInputDialog.TextInput)
+    ok_answer = dialog.exec() == QDialog.Accepted
+    return ok_answer, dialog.textValue()
+
+
 def popup_error(message, parent):
     """Display a dialog with an informative message and an Ok button."""
     dialog = QMessageBox(parent)
@@ -479,7 +496,7 @@ class UserInterface(object):
 
     @property
     def cv_stats(self):
-        """Return reference to a list of model.Statistics objects.
+        """Return reference to a model.CVStatistics object.
 
            Or None if the internal attribute is not set.
         """
@@ -487,15 +504,10 @@ class UserInterface(object):
 
     @cv_stats.setter
     def cv_stats(self, value):
-        """Ensure that value is a list of list."""
-        if not isinstance(value, list) or not isinstance(value[0], list):
-            raise TypeError('value assigned to self.cv_stats is not a list '
-                            'of lists ({})'.format(repr(value)))
-        for sublist in value:
-            if not isinstance(sublist, list) or len(sublist) != len(value[0]):
-                raise TypeError('value assigned to self.cv_stats is not '
-                                'composed by lists of the same length '
-                                '({})'.format(repr(value)))
+        """Ensure that value is a model.CVStatistics object."""
+        if not isinstance(value, model.CVStatistics):
+            raise TypeError('value assigned to self.cv_stats is not a '
+                            'model.CVStatistics ({})'.format(repr(value)))
         self._cv_stats = value
         self.change_plot_enabled_flag('RMSECV', True)
         self.update_right_cv_info()
@@ -548,6 +560,7 @@ class UserInterface(object):
                    ('&Load model', 'Ctrl+L'),
                    ('1_ Separator', None),
                    ('Load csv to &predict', 'Ctrl+R'),
+                   ('Re&move samples', 'Ctrl+D'),
                    ('2_ Separator', None),
                    ('&Export matrices', 'Ctrl+E'),
                    ('3_ Separator', None),
@@ -643,6 +656,10 @@ class UserInterface(object):
         """Number of Splits in the SpinBox in the right CV area."""
         return getattr(self, 'RightSplitsCVSpinBox').value()
 
+    def right_cv_workers(self):
+        """Number of Workers in the SpinBox in the right CV area."""
+        return getattr(self, 'RightWorkersCVSpinBox').value()
+
     def scroll_area(self, lane):
         return getattr(self, str(lane) + 'ScrollArea')
 
@@ -697,6 +714,7 @@ class UserInterface(object):
 
         self.SaveModelAction.setEnabled(self.current_mode != Mode.Start)
         self.LoadCsvToPredictAction.setEnabled(self.current_mode != Mode.Start)
+        self.RemoveSamplesAction.setEnabled(self.current_mode != Mode.Start)
         self.ExportMatricesAction.setEnabled(self.current_mode != Mode.Start)
         self.LeftComboBox.setEnabled(self.current_mode != Mode.Start)
         self.CentralComboBox.setEnabled(self.current_mode != Mode.Start)
@@ -713,6 +731,7 @@ class UserInterface(object):
         self.update_right_cv_samples_spinbox(
             minimum=1, maximum=getattr(self.plsda_model, 'n', 219),
             enabled=self.current_mode == Mode.CV)
+        self.RightWorkersCVSpinBox.setEnabled(self.current_mode == Mode.CV)
         self.right_cv_start_button().setEnabled(self.current_mode == Mode.CV)
 
         if self.current_mode == Mode.Prediction and \
@@ -836,11 +855,20 @@ class UserInterface(object):
                       parent_widget=parent, size=(45, 25, 55, 520))
         sb.setEnabled(False)
 
-        self.add(QPushButton, lane, Column.Both, row=3, name='Start',
+        self.add(QLabel, lane, Column.Left, row=3, name='Workers',
+                 text='Workers:', word_wrap=False,
+                 label_alignment=Qt.AlignLeft, parent_widget=parent,
+                 size=(50, 20, 55, 520))
+        sb = self.add(QSpinBox, lane, Column.Right, row=3, name='Workers',
+                      minimum=1, maximum=os.cpu_count() or 1,
+                      parent_widget=parent, size=(45, 25, 55, 520))
+        sb.setEnabled(False)
+
+        self.add(QPushButton, lane, Column.Both, row=4, name='Start',
                  text='Start CV', parent_widget=parent,
                  size=(70, 25, 109, 520))
 
-        self.add(QLabel, lane, Column.Both, row=4, name='CVInfo',
+        self.add(QLabel, lane, Column.Both, row=5, name='CVInfo',
                  text=cv_info, label_alignment=Qt.AlignLeft,
                  parent_widget=parent, size=(105, 1, 306, 1000))
 
@@ -909,16 +937,12 @@ class UserInterface(object):
                 return
 
             lv = self.plsda_model.nr_lv - 1  # because it would start from 1
-            rss = np.zeros((self.cv_stats[0][lv].p))
-            tss = np.zeros((self.cv_stats[0][lv].p))
-            for i in range(len(self.cv_stats)):  # split
-                for k in range(self.cv_stats[i][lv].p):
-                    rss[k] += self.cv_stats[i][lv].rss[k]
-                    tss[k] += self.cv_stats[i][lv].tss[k]
+            rss = np.sum(self.cv_stats.rss[:, lv], axis=0)
+            tss = np.sum(self.cv_stats.tss[:, lv], axis=0)
 
             IO.Log.info("rss {} tss {}".format(rss, tss))
-            rmsecv = np.sqrt(rss / self.plsda_model.n)
-            r_square = 1 - rss/tss
+            rmsecv = self.cv_stats.rmsecv[:, lv]
+            r_square = self.cv_stats.r_squared[:, lv]
 
             text = 'RMSECV:\n{}\n'.format(utility.list_to_string(rmsecv))
             text += 'R² CV:\n{}'.format(utility.list_to_string(r_square))
@@ -1578,8 +1602,11 @@ class UserInterface(object):
     def draw_rmesep_plot(self, lane, refresh=False):
         plot.rmsep_lv(self.figure(lane).add_subplot(111))
 
-    def new_model(self):
-        """Initialize plsda_model attribute from csv."""
+    def new_model(self, engine='nipals'):
+        """Initialize plsda_model attribute from csv.
+
+           The model is built with the given engine (see model.ENGINES).
+        """
         if not self._replace_current_model():
             return
 
@@ -1613,7 +1640,7 @@ class UserInterface(object):
             IO.Log.debug('CANCEL (not chosen any preprocessing)')
 
         try:
-            plsda_model = model.nipals(train_set.x, train_set.y)
+            plsda_model = model.fit(train_set.x, train_set.y, engine=engine)
         except Exception as e:
             IO.Log.debug(str(e))
             popup_error(message=str(e), parent=self.MainWindow)
@@ -1720,6 +1747,41 @@ class UserInterface(object):
         IO.Log.debug('TestSet created correctly')
         self.current_mode = Mode.Prediction
 
+    def remove_samples(self):
+        """Remove samples (e.g. outliers) from train_set and plsda_model."""
+        ok, text = popup_input_text('Indices of the samples to remove '
+                                    '(comma separated):',
+                                    parent=self.MainWindow,
+                                    title='Remove samples')
+        if not ok or not text.strip():
+            return
+
+        nr_lv = self.plsda_model.nr_lv
+        try:
+            indices = [int(index) for index in text.split(',')]
+            self.plsda_model.remove(self.train_set, indices)
+        except Exception as e:
+            IO.Log.debug(str(e))
+            popup_error(message=str(e), parent=self.MainWindow)
+            return
+        self.plsda_model.nr_lv = min(nr_lv, self.plsda_model.max_lv)
+
+        # refresh the references of the plots and the info in right lane
+        self.train_set = self.train_set
+        self.plsda_model = self.plsda_model
+        IO.Log.debug('Samples removed correctly')
+        self.RightLVsModelSpinBox.setValue(self.plsda_model.nr_lv)
+        if self.test_set is not None:
+            # mean and sigma of train_set changed with its samples
+            self.test_set.rescale(self.train_set)
+            self.prediction_stats = model.Statistics(
+                y_real=self.test_set.y,
+                y_pred=self.plsda_model.predict(self.test_set.x))
+            self.test_set = self.test_set
+        if self.cv_stats is not None:
+            self.cross_validation_wrapper()
+        self.update_visible_plots()
+
     def export_matrices(self):
         all_matrices = (
             ('X', '(n x m', 'matrix of predictors)', 'X'),
@@ -1836,7 +1898,9 @@ class UserInterface(object):
         sample = self.right_cv_samples()
         max_lv = self.plsda_model.max_lv
         try:
-            ret = model.cross_validation(self.train_set, split, sample, max_lv)
+            ret = model.cross_validation(self.train_set, split, sample, max_lv,
+                                         engine=self.plsda_model.engine,
+                                         n_jobs=self.right_cv_workers())
         except Exception as e:
             IO.Log.debug(str(e))
             popup_error(message=str(e), parent=self.MainWindow)
@@ -1845,10 +1909,12 @@ class UserInterface(object):
             self.update_visible_plots()
 
     def connect_handlers(self):
-        self.NewModelAction.triggered.connect(self.new_model)
+        # lambda avoids the checked flag to be passed as engine
+        self.NewModelAction.triggered.connect(lambda: self.new_model())
         self.SaveModelAction.triggered.connect(self.save_model)
         self.LoadModelAction.triggered.connect(self.load_model)
         self.LoadCsvToPredictAction.triggered.connect(self.load_csv_to_predict)
+        self.RemoveSamplesAction.triggered.connect(self.remove_samples)
         self.ExportMatricesAction.triggered.connect(self.export_matrices)
         self.QuitAction.triggered.connect(self.quit)
 
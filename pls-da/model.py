@@ -24,8 +24,16 @@ __copyright__ = "PLS-DA  Copyright (C)  2017"
 __license__ = "GPL3"
 
 
+import concurrent.futures
 import math
+import multiprocessing
 import numpy as np
+import operator
+import os
+import scipy.linalg
+import scipy.sparse
+import sys
+import time
 
 import IO
 import utility
@@ -37,13 +45,14 @@ if __name__ == '__main__':
 
 class Dataset(object):
     """Represent a chemometrics dataset."""
-    def __init__(self, input_file=None):
+    def __init__(self, input_file=None, dtype=np.float64, sparse=False):
         """Load and parse csv input file.
 
            self.header      list of samples' properties (text)
            self.categorical_y  list of samples' labels (text)
-           self.x           list of samples' values (float)
-           self.y           list of samples' labels (1 or 0)
+           self.x           list of samples' values (dtype), a CSR matrix
+                            if sparse is True
+           self.y           list of samples' labels (1 or 0, dtype)
 
            self.axis        axis to compute std and mean
         """
@@ -55,36 +64,74 @@ class Dataset(object):
             self.categorical_y = [row[0] for row in body]
             self.categories = utility.get_unique_list(self.categorical_y)
 
-            self.x = np.array([np.array(row[1:]) for row in body])
+            self.x = np.array([np.array(row[1:]) for row in body],
+                              dtype=dtype)
             IO.Log.debug('Loaded dataset', self.x)
+            if sparse:
+                self.x = scipy.sparse.csr_matrix(self.x)
 
             self.y = np.array([[1.0 if c == cat else 0.0
                                 for c in self.categorical_y]
-                               for cat in self.categories]).T
+                               for cat in self.categories], dtype=dtype).T
             IO.Log.debug('Dummy y', self.y)
 
-            self.mean_x = np.zeros(self.m)
-            self.mean_y = np.zeros(self.p)
-            self.sigma_x = np.ones(self.m)
-            self.sigma_y = np.ones(self.p)
+            self.mean_x = np.zeros(self.m, dtype=dtype)
+            self.mean_y = np.zeros(self.p, dtype=dtype)
+            self.sigma_x = np.ones(self.m, dtype=dtype)
+            self.sigma_y = np.ones(self.p, dtype=dtype)
             self.axis = 0
             self._centered = False
             self._normalized = False
 
+    @property
+    def x(self):
+        """Return the samples' values, built here if the changes of
+           TrainingSet.update() are still pending (see _LazyRows)."""
+        if isinstance(self._x, _LazyRows):
+            self._x = self._x.toarray()
+        return self._x
+
+    @x.setter
+    def x(self, value):
+        self._x = value
+
+    @property
+    def y(self):
+        """Return the dummy y, built here if pending like x."""
+        if isinstance(self._y, _LazyRows):
+            self._y = self._y.toarray()
+        return self._y
+
+    @y.setter
+    def y(self, value):
+        self._y = value
+
+    @property
+    def dtype(self):
+        """Return the floating point type of x."""
+        return self._x.dtype
+
+    @property
+    def sparse(self):
+        """Return whether x is a (maybe implicitly preprocessed) sparse
+           matrix."""
+        return scipy.sparse.issparse(self._x) or \
+            isinstance(self._x, CenteredSparse)
+
     @property
     def n(self):
         """Return number of rows of x (or of dummy y)."""
-        return self.x.shape[0]
+        return self._x.shape[0]
 
     @property
     def m(self):
         """Return number of columns of x."""
-        return self.x.shape[1]
+        return self._x.shape[1]
 
     @property
     def p(self):
         """Return number of columns in dummy y."""
-        return self.y.shape[1]
+        return self._y.shape[1]
 
     @property
     def centered(self):
@@ -116,10 +163,16 @@ class TrainingSet(Dataset):
             IO.Log.warning('Already centered dataset')
             return
 
-        self.mean_x = self.x.mean(axis=self.axis)
-        self.x = self.x - self.mean_x
-        if not quiet:
-            IO.Log.debug('Centered x', self.x)
+        if self.sparse:
+            # the centered x would be dense, so it is centered implicitly
+            sparse_x = getattr(self.x, 'X', self.x)
+            self.mean_x = np.asarray(sparse_x.mean(axis=self.axis)).ravel()
+            self.x = CenteredSparse(sparse_x, self.mean_x, self.sigma_x)
+        else:
+            self.mean_x = self.x.mean(axis=self.axis)
+            self.x = self.x - self.mean_x
+            if not quiet:
+                IO.Log.debug('Centered x', self.x)
 
         self.mean_y = self.y.mean(axis=self.axis)
         self.y = self.y - self.mean_y
@@ -131,10 +184,18 @@ class TrainingSet(Dataset):
             IO.Log.warning('Already normalized dataset')
             return
 
-        self.sigma_x = self.x.std(axis=self.axis)
-        self.x = self.x / self.sigma_x
-        if not quiet:
-            IO.Log.debug('Normalized dataset', self.x)
+        if self.sparse:
+            sparse_x = getattr(self.x, 'X', self.x)
+            mean = np.asarray(sparse_x.mean(axis=self.axis)).ravel()
+            mean_square = np.asarray(
+                sparse_x.multiply(sparse_x).mean(axis=self.axis)).ravel()
+            self.sigma_x = np.sqrt(mean_square - np.power(mean, 2))
+            self.x = CenteredSparse(sparse_x, self.mean_x, self.sigma_x)
+        else:
+            self.sigma_x = self.x.std(axis=self.axis)
+            self.x = self.x / self.sigma_x
+            if not quiet:
+                IO.Log.debug('Normalized dataset', self.x)
 
         self.sigma_y = self.y.std(axis=self.axis)
         self.y = self.y / self.sigma_y
@@ -148,7 +209,148 @@ class TrainingSet(Dataset):
 
         self.center(quiet=True)
         self.normalize(quiet=True)
-        IO.Log.debug('Autoscaled dataset', self.x)
+        if not self.sparse:
+            IO.Log.debug('Autoscaled dataset', self.x)
+
+    def _raw_samples(self):
+        """Return x and y as they were before the preprocessing."""
+        return self.x * self.sigma_x + self.mean_x, \
+            self.y * self.sigma_y + self.mean_y
+
+    def _raw_moments(self):
+        """Return (number of samples, mean, centered cross products) of the
+           raw [x y] matrix, computed from the samples the first time and
+           then kept up to date by update() and remove()."""
+        if not hasattr(self, '_moments'):
+            z = np.hstack(self._raw_samples())
+            mean = z.mean(axis=self.axis)
+            z -= mean
+            self._moments = (self.n, mean, np.dot(z.T, z))
+        return self._moments
+
+    def _set_moments(self, moments):
+        """Set the raw moments and, if the dataset is centered or
+           normalized, the mean and the sigma they give. x and y are
+           rescaled to them lazily, see _LazyRows."""
+        total, mean, cross = self._moments = moments
+        mean_x, sigma_x = self.mean_x, self.sigma_x
+        mean_y, sigma_y = self.mean_y, self.sigma_y
+        if self.centered:
+            self.mean_x = mean[:self.m].astype(self.dtype)
+            self.mean_y = mean[self.m:].astype(self.dtype)
+        if self.normalized:
+            sigma = np.sqrt(np.diag(cross) / total)
+            self.sigma_x = sigma[:self.m].astype(self.dtype)
+            self.sigma_y = sigma[self.m:].astype(self.dtype)
+
+        # (raw - old mean) / old sigma  ->  (raw - mean) / sigma
+        self._x = _LazyRows.of(self._x).rescaled(
+            sigma_x / self.sigma_x, (mean_x - self.mean_x) / self.sigma_x)
+        self._y = _LazyRows.of(self._y).rescaled(
+            sigma_y / self.sigma_y, (mean_y - self.mean_y) / self.sigma_y)
+
+    def update(self, x, categorical_y):
+        """Add new samples to the dataset.
+
+           x are the raw values of the new samples and categorical_y their
+           labels, which must be among the known categories.
+           The mean and the sigma of x and y (if the dataset is centered
+           or normalized) and the cross products of cross_products() are
+           updated, and the new samples appended, at a cost proportional
+           to the number of new samples: rescaling the old samples to the
+           new statistics is left to the first read of x and y.
+           Return x and the dummy y of the new samples, preprocessed.
+        """
+        if self.sparse:
+            raise ValueError('Sparse datasets can not be updated')
+        unknown = set(categorical_y) - set(self.categories)
+        if unknown:
+            raise ValueError('Unknown categories {}'.format(sorted(unknown)))
+        x = np.array(x, dtype=self.dtype, ndmin=2)
+        y = np.array([[1.0 if c == cat else 0.0 for cat in self.categories]
+                      for c in categorical_y], dtype=self.dtype)
+        if x.shape != (len(y), self.m):
+            raise ValueError('Expected {} samples of {} values, got x of '
+                             'shape {}'.format(len(y), self.m, x.shape))
+
+        # Chan et al. pairwise update of mean and centered cross products
+        n, mean, cross = self._raw_moments()
+        z = np.hstack((x, y))
+        batch_mean = z.mean(axis=self.axis)
+        batch_z = z - batch_mean
+        delta = batch_mean - mean
+        total = n + len(z)
+        cross = cross + np.dot(batch_z.T, batch_z) + \
+            np.outer(delta, delta) * n * len(z) / total
+        mean = mean + delta * len(z) / total
+
+        self._set_moments((total, mean, cross))
+        self.body.extend([c] + row.tolist()
+                         for c, row in zip(categorical_y, x))
+        self.categorical_y.extend(categorical_y)
+        x = (x - self.mean_x) / self.sigma_x
+        y = (y - self.mean_y) / self.sigma_y
+        self._x = self._x.appended(x)
+        self._y = self._y.appended(y)
+        IO.Log.debug('Added {} samples'.format(len(z)))
+        return x, y
+
+    def remove(self, indices):
+        """Remove the samples (rows of x and y) at the given indices.
+
+           The mean and the sigma of x and y and the cross products of
+           cross_products() are downdated, and the samples removed, at a
+           cost proportional to the number of removed samples: as in
+           update(), rescaling the remaining samples is left to the first
+           read of x and y.
+           Raise ValueError, leaving the dataset untouched, if the indices
+           are out of bounds or if too few samples would be left.
+        """
+        if self.sparse:
+            raise ValueError('Sparse datasets can not be downdated')
+        indices = np.unique(np.asarray(indices, dtype=int))
+        if indices.size == 0:
+            return
+        if indices[0] < 0 or indices[-1] >= self.n:
+            raise ValueError('Sample indices out of bounds '
+                             '[0, {}]'.format(self.n - 1))
+
+        # inverse of the pairwise update done by update()
+        n, mean, cross = self._raw_moments()
+        x = _LazyRows.of(self._x).take(indices) * self.sigma_x + self.mean_x
+        y = _LazyRows.of(self._y).take(indices) * self.sigma_y + self.mean_y
+        z = np.hstack((x, y))
+        total = n - len(z)
+        if total < 2:
+            raise ValueError('At least two samples must be left')
+        batch_mean = z.mean(axis=self.axis)
+        batch_z = z - batch_mean
+        mean = (n * mean - len(z) * batch_mean) / total
+        delta = batch_mean - mean
+        cross = cross - np.dot(batch_z.T, batch_z) - \
+            np.outer(delta, delta) * total * len(z) / n
+        if np.any(mean[self.m:] * total < 0.5):
+            raise ValueError('Every sample of a category would be removed')
+
+        self._x = _LazyRows.of(self._x).deleted(indices)
+        self._y = _LazyRows.of(self._y).deleted(indices)
+        self._set_moments((total, mean, cross))
+        for i in indices[::-1]:
+            del self.categorical_y[i]
+            del self.body[i]
+        IO.Log.debug('Removed samples {}'.format(list(indices)))
+
+    def cross_products(self):
+        """Return X'X, X'Y and Y'Y of the samples, preprocessed with the
+           current statistics of the dataset, from the raw moments kept up
+           to date by update() and remove()."""
+        n, mean, cross = self._raw_moments()
+        if not self.centered:
+            cross = cross + n * np.outer(mean, mean)
+        sigma = np.concatenate((self.sigma_x, self.sigma_y))
+        cross = cross / np.outer(sigma, sigma)
+        m = self.m
+        return cross[:m, :m], cross[:m, m:], cross[m:, m:]
 
     def empty_method(self):
         """Do not remove this method, it is needed by the GUI."""
@@ -158,52 +360,487 @@ class TrainingSet(Dataset):
 class TestSet(Dataset):
     """Model a test set."""
     def __init__(self, filename, train_set):
-        super().__init__(filename)
-
         # apply the same transformation used on the test set
         assert isinstance(train_set,
                           TrainingSet), 'argument train_set must be of type' \
                                         'TrainingSet, is instead of ' \
                                         'type {}'.format(type(train_set))
 
+        super().__init__(filename, dtype=train_set.dtype,
+                         sparse=train_set.sparse)
+
         self.mean_x = train_set.mean_x
         self.sigma_x = train_set.sigma_x
         self.mean_y = train_set.mean_y
         self.sigma_y = train_set.sigma_y
-        self.x -= self.mean_x
-        self.x /= self.sigma_x
+        if self.sparse:
+            self.x = CenteredSparse(self.x, self.mean_x, self.sigma_x)
+        else:
+            self.x -= self.mean_x
+            self.x /= self.sigma_x
         self.y -= self.mean_y
         self.y /= self.sigma_y
         self._centered = train_set.centered
         self._normalized = train_set.normalized
 
+    def rescale(self, train_set):
+        """Preprocess the samples again with the current mean and sigma of
+           train_set, e.g. after its update() or remove()."""
+        if self.sparse:
+            self.x = CenteredSparse(self.x.X, train_set.mean_x,
+                                    train_set.sigma_x)
+        else:
+            self.x = (self.x * self.sigma_x + self.mean_x -
+                      train_set.mean_x) / train_set.sigma_x
+        self.y = (self.y * self.sigma_y + self.mean_y -
+                  train_set.mean_y) / train_set.sigma_y
+        self.mean_x = train_set.mean_x
+        self.sigma_x = train_set.sigma_x
+        self.mean_y = train_set.mean_y
+        self.sigma_y = train_set.sigma_y
+
+
+class _LazyRows(object):
+    """Dense matrix whose new rows, deleted rows and column rescaling are
+       applied lazily.
+
+       The rows are kept in blocks as they were stored, together with the
+       sorted positions of the deleted stored rows and the column-wise map
+       scale * stored + shift to their current values, so that appending,
+       deleting or reading k rows or rescaling the columns costs time
+       proportional to k and to the number of columns. Every operation
+       returns a new _LazyRows and blocks are never written, thus matrices
+       already handed out never change. toarray() builds the matrix once.
+    """
+
+    def __init__(self, blocks, scale, shift, n, deleted=None):
+        self._blocks = blocks
+        self._scale = scale
+        self._shift = shift
+        self._n = n
+        self._deleted = np.zeros(0, dtype=int) if deleted is None \
+            else deleted
+        self._array = None
+
+    @staticmethod
+    def of(x):
+        """Return the dense x as a _LazyRows (x itself if it is one)."""
+        if isinstance(x, _LazyRows):
+            return x
+        return _LazyRows([x], np.ones(x.shape[1], dtype=x.dtype),
+                         np.zeros(x.shape[1], dtype=x.dtype), x.shape[0])
+
+    @property
+    def shape(self):
+        return self._n, self._scale.shape[0]
+
+    @property
+    def dtype(self):
+        return self._blocks[0].dtype
+
+    def rescaled(self, scale, shift):
+        """Return the matrix with columns mapped to scale * x + shift."""
+        return _LazyRows(self._blocks, self._scale * scale,
+                         self._shift * scale + shift, self._n, self._deleted)
+
+    def appended(self, rows):
+        """Return the matrix followed by the given rows."""
+        stored = ((rows - self._shift) / self._scale).astype(self.dtype)
+        return _LazyRows(self._blocks + [stored], self._scale, self._shift,
+                         self._n + rows.shape[0], self._deleted)
+
+    def _stored(self, indices):
+        """Return the stored positions of the rows at the sorted indices."""
+        # the j-th deleted position is preceded by deleted[j] - j rows
+        before = self._deleted - np.arange(self._deleted.size)
+        return indices + np.searchsorted(before, indices, side='right')
+
+    def take(self, indices):
+        """Return the rows at the sorted indices as a numpy array."""
+        if self._array is not None:
+            return self._array[indices]
+        stored = self._stored(indices)
+        offsets = np.cumsum([0] + [len(block) for block in self._blocks])
+        in_block = np.searchsorted(offsets, stored, side='right') - 1
+        rows = np.empty((len(indices), self.shape[1]), dtype=self.dtype)
+        for b in np.unique(in_block):
+            mask = in_block == b
+            rows[mask] = self._blocks[b][stored[mask] - offsets[b]]
+        return (rows * self._scale + self._shift).astype(self.dtype)
+
+    def deleted(self, indices):
+        """Return the matrix without the rows at the sorted indices."""
+        deleted = np.union1d(self._deleted, self._stored(indices))
+        return _LazyRows(self._blocks, self._scale, self._shift,
+                         self._n - len(indices), deleted)
+
+    def toarray(self):
+        """Return the matrix as a numpy array, built only once."""
+        if self._array is None:
+            stored = self._blocks[0] if len(self._blocks) == 1 \
+                else np.concatenate(self._blocks)
+            if self._deleted.size:
+                stored = np.delete(stored, self._deleted, axis=0)
+            if np.all(self._scale == 1) and not np.any(self._shift):
+                self._array = stored
+            else:
+                self._array = (stored * self._scale +
+                               self._shift).astype(self.dtype)
+        return self._array
+
+
+class CenteredSparse(object):
+    """Sparse matrix X implicitly centered and scaled: (X - mean) / sigma.
+
+       The centered matrix would be dense, so it is never built: products
+       are computed on the sparse X and corrected with the mean, keeping
+       time and memory proportional to the non-zeros of X.
+    """
+
+    def __init__(self, X, mean, sigma):
+        self.X = X
+        self.mean = np.asarray(mean, dtype=X.dtype)
+        self.sigma = np.asarray(sigma, dtype=X.dtype)
+
+    @property
+    def shape(self):
+        return self.X.shape
+
+    @property
+    def dtype(self):
+        return self.X.dtype
+
+    @property
+    def nnz(self):
+        return self.X.nnz
+
+    @property
+    def T(self):
+        """Return the transposed matrix, only able to compute products."""
+        return _Transposed(self)
+
+    def dot(self, v):
+        """Return (X - mean) / sigma * v."""
+        v = (v.T / self.sigma).T
+        return self.X.dot(v) - np.dot(self.mean, v)
+
+    def tdot(self, u):
+        """Return ((X - mean) / sigma)' * u."""
+        xtu = self.X.T.dot(u) - np.multiply.outer(self.mean,
+                                                  np.sum(u, axis=0))
+        return (xtu.T / self.sigma).T
+
+    def gram(self):
+        """Return the dense m x m matrix X'X of the centered X."""
+        col_sums = np.asarray(self.X.sum(axis=0)).ravel()
+        mean_col_sums = np.outer(self.mean, col_sums)
+        XtX = self.X.T.dot(self.X).toarray() - mean_col_sums - \
+            mean_col_sums.T + self.X.shape[0] * np.outer(self.mean, self.mean)
+        return XtX / np.outer(self.sigma, self.sigma)
+
+    def outer_gram(self):
+        """Return the dense n x n matrix XX' of the centered X."""
+        X = self.X.dot(scipy.sparse.diags(1 / self.sigma))
+        mean = self.mean / self.sigma
+        Xmean = X.dot(mean)
+        return X.dot(X.T).toarray() - Xmean[:, np.newaxis] - Xmean + \
+            np.dot(mean, mean)
+
+    def sum_of_squares(self):
+        """Return the sum of the squares of the elements of the centered X.
+        """
+        sums = np.asarray(self.X.sum(axis=0)).ravel()
+        squares = np.asarray(self.X.multiply(self.X).sum(axis=0)).ravel()
+        n = self.X.shape[0]
+        return np.sum((squares - 2 * self.mean * sums +
+                       n * np.power(self.mean, 2)) / np.power(self.sigma, 2))
+
+    def toarray(self):
+        """Return the dense centered X."""
+        return (self.X.toarray() - self.mean) / self.sigma
+
+
+class BlockedMatrix(object):
+    """Matrix X streamed in row blocks, never loaded in memory as a whole.
+
+       source is either an array sliceable by rows (e.g. a numpy.memmap),
+       read block_size rows at a time, or a callable returning a new
+       iterator over the row blocks of X at every call (the blocks are
+       used as they come). Every block is preprocessed on the fly as
+       (block - mean) / sigma, when they are given.
+       Products are streaming passes over the blocks, so besides the n or
+       m long vectors involved only one block at a time is in memory.
+    """
+
+    def __init__(self, source, block_size=1024, mean=None, sigma=None):
+        if block_size < 1:
+            raise ValueError('Block size must be positive, '
+                             'got {}'.format(block_size))
+        self.source = source
+        self.block_size = int(block_size)
+        self.mean = mean
+        self.sigma = sigma
+
+        if callable(source):
+            n, m, dtype = 0, None, None
+            for block in source():
+                n += block.shape[0]
+                m, dtype = block.shape[1], block.dtype
+            if m is None:
+                raise ValueError('No blocks in the chunk iterator')
+            self.shape = (n, m)
+            self.dtype = np.dtype(dtype)
+        else:
+            self.shape = tuple(source.shape)
+            self.dtype = np.dtype(source.dtype)
+
+    @property
+    def T(self):
+        """Return the transposed matrix, only able to compute products."""
+        return _Transposed(self)
+
+    def blocks(self):
+        """Yield (index of the first row, block) for every block of X."""
+        if callable(self.source):
+            chunks = self.source()
+        else:
+            chunks = (self.source[start:start + self.block_size]
+                      for start in range(0, self.shape[0], self.block_size))
+        start = 0
+        for block in chunks:
+            block = np.asarray(block, dtype=self.dtype)
+            if self.mean is not None:
+                block = block - self.mean
+            if self.sigma is not None:
+                block = block / self.sigma
+            yield start, block
+            start += block.shape[0]
+
+    def statistics(self):
+        """Return mean and standard deviation of the columns of X in a
+           single pass."""
+        sums = np.zeros(self.shape[1])
+        squares = np.zeros(self.shape[1])
+        for _, block in self.blocks():
+            sums += np.sum(block, axis=0)
+            squares += np.sum(np.power(block, 2), axis=0)
+        mean = sums / self.shape[0]
+        sigma = np.sqrt(np.maximum(squares / self.shape[0] -
+                                   np.power(mean, 2), 0))
+        return mean.astype(self.dtype), sigma.astype(self.dtype)
+
+    def dot(self, v):
+        """Return X * v."""
+        v = np.asarray(v)
+        Xv = np.empty((self.shape[0],) + v.shape[1:],
+                      dtype=np.result_type(self.dtype, v.dtype))
+        for start, block in self.blocks():
+            Xv[start:start + block.shape[0]] = np.dot(block, v)
+        return Xv
+
+    def tdot(self, u):
+        """Return X' * u."""
+        u = np.asarray(u)
+        Xtu = np.zeros((self.shape[1],) + u.shape[1:],
+                       dtype=np.result_type(self.dtype, u.dtype))
+        for start, block in self.blocks():
+            Xtu += np.dot(block.T, u[start:start + block.shape[0]])
+        return Xtu
+
+    def gram(self):
+        """Return the m x m matrix X'X."""
+        XtX = np.zeros((self.shape[1], self.shape[1]), dtype=self.dtype)
+        for _, block in self.blocks():
+            XtX += np.dot(block.T, block)
+        return XtX
+
+    def outer_gram(self):
+        """Return the n x n matrix XX', one pass for every block."""
+        XXt = np.empty((self.shape[0], self.shape[0]), dtype=self.dtype)
+        for start, block in self.blocks():
+            XXt[:, start:start + block.shape[0]] = self.dot(block.T)
+        return XXt
+
+    def sum_of_squares(self):
+        """Return the sum of the squares of the elements of X."""
+        return sum(np.sum(np.power(block, 2)) for _, block in self.blocks())
+
+    def toarray(self):
+        """Return X loaded in memory."""
+        return np.concatenate([block for _, block in self.blocks()])
+
+
+class _Transposed(object):
+    """Transposed view of a CenteredSparse or a BlockedMatrix."""
+
+    def __init__(self, matrix):
+        self.matrix = matrix
+
+    @property
+    def shape(self):
+        return self.matrix.shape[::-1]
+
+    def dot(self, u):
+        return self.matrix.tdot(u)
+
+
+def _dense(X):
+    """Return X as a numpy array."""
+    return X if isinstance(X, np.ndarray) else X.toarray()
+
+
+def _gram(X):
+    """Return X'X as a dense array for any supported kind of X."""
+    if isinstance(X, np.ndarray):
+        return np.dot(X.T, X)
+    if isinstance(X, (CenteredSparse, BlockedMatrix)):
+        return X.gram()
+    return X.T.dot(X).toarray()
+
+
+def _outer_gram(X):
+    """Return XX' as a dense array for any supported kind of X."""
+    if isinstance(X, np.ndarray):
+        return np.dot(X, X.T)
+    if isinstance(X, (CenteredSparse, BlockedMatrix)):
+        return X.outer_gram()
+    return X.dot(X.T).toarray()
+
+
+def _sum_of_squares(X):
+    """Return the sum of the squares of the elements of X."""
+    if isinstance(X, np.ndarray):
+        return np.sum(np.power(X, 2))
+    if isinstance(X, (CenteredSparse, BlockedMatrix)):
+        return X.sum_of_squares()
+    return X.multiply(X).sum()
+
+
+class StoppingCriteria(object):
+    """Stop the extraction of latent variables when they become useless.
+
+       explained_x   cumulative percentage of the sum of squares of X
+       explained_y   cumulative percentage of the sum of squares of Y
+       time_budget   seconds of wall-clock time
+       min_residual  Frobenius norm of the residuals of X
+
+       Criteria left to None are not checked.
+    """
+
+    def __init__(self, explained_x=None, explained_y=None, time_budget=None,
+                 min_residual=None):
+        self.explained_x = explained_x
+        self.explained_y = explained_y
+        self.time_budget = time_budget
+        self.min_residual = min_residual
+
+        self._x_ss = self._x_left = 0.0
+        self._y_ss = self._y_left = 0.0
+        self._clock = time.perf_counter()
+
+    def start(self, x_ss, y_ss):
+        """Restart the clock and set the total sums of squares of X and Y."""
+        self._x_ss = self._x_left = float(x_ss)
+        self._y_ss = self._y_left = float(y_ss)
+        self._clock = time.perf_counter()
+
+    def update(self, t_square, b):
+        """Account a new latent variable and return why to stop or None.
+
+           t_square is the squared norm of its X scores and b its inner
+           relation coefficient, loadings P and Q must have unit length.
+        """
+        self._x_left -= t_square
+        self._y_left -= b ** 2 * t_square
+
+        if self.explained_x is not None and self._x_ss > 0 and \
+                100 * (1 - self._x_left / self._x_ss) >= self.explained_x:
+            return 'explained_x'
+        if self.explained_y is not None and self._y_ss > 0 and \
+                100 * (1 - self._y_left / self._y_ss) >= self.explained_y:
+            return 'explained_y'
+        if self.min_residual is not None and \
+                math.sqrt(max(self._x_left, 0.0)) <= self.min_residual:
+            return 'min_residual'
+        if self.time_budget is not None and \
+                time.perf_counter() - self._clock >= self.time_budget:
+            return 'time_budget'
+        return None
+
+
+# key of the cached properties of Model which depend on the number of lv
+_per_lv = operator.attrgetter('nr_lv')
+
 
 class Model(object):
     """Save a NIPALS model and provide helper methods to access it."""
 
-    def __init__(self, X, Y, max_lv):
-        """Instantiate space for the model."""
+    def __init__(self, X, Y, max_lv, engine='nipals', scores=True):
+        """Instantiate space for the model, without the n x max_lv scores
+           T and U if scores is False (see update())."""
 
         self.X = X
         self.Y = Y
+        # float32 data stay float32, anything else is computed in float64
+        self.dtype = np.result_type(X.dtype, Y.dtype, np.float32)
         self.n = X.shape[0]
         self.m = X.shape[1]
         self.p = Y.shape[1]
 
+        self.engine = engine  # name of the algorithm which filled the model
+        self.stop_reason = None  # why the extraction of lv stopped
         self.max_lv = max_lv  # number of lv in which the model was calculated
         self._nr_lv = max_lv  # number of lv used for prediction
 
-        self._T = np.zeros((self.n, max_lv))
-        self._P = np.zeros((self.m, max_lv))
-        self._W = np.zeros((self.m, max_lv))
-        self._U = np.zeros((self.n, max_lv))
-        self._Q = np.zeros((self.p, max_lv))
+        if scores:
+            self._T = np.zeros((self.n, max_lv), dtype=self.dtype)
+            self._U = np.zeros((self.n, max_lv), dtype=self.dtype)
+        self._P = np.zeros((self.m, max_lv), dtype=self.dtype)
+        self._W = np.zeros((self.m, max_lv), dtype=self.dtype)
+        self._Q = np.zeros((self.p, max_lv), dtype=self.dtype)
+
+        self._b = np.zeros(max_lv, dtype=self.dtype)
+        self.iterations = np.zeros(max_lv, dtype=int)
+        # inner iterations spared by a warm start, see nipals()
+        self.saved_iterations = np.zeros(max_lv, dtype=int)
+        self._x_eigenvalues = np.zeros(max_lv, dtype=self.dtype)
+        self._y_eigenvalues = np.zeros(max_lv, dtype=self.dtype)
+        self._XtX = None  # kept by tall SIMPLS models, see _gram_x()
+
+    def __getattr__(self, name):
+        """Compute the scores T and U of a model refitted by update() the
+           first time they are needed, from its _score_weights (R, D):
+           T = X * R and U = Y * Q - T * D."""
+        if name not in ('_T', '_U') or '_score_weights' not in vars(self):
+            raise AttributeError(name)
+        R, D = vars(self).pop('_score_weights')
+        self._T = self.X.dot(R).astype(self.dtype)
+        self._U = (np.dot(self.Y, self._Q) -
+                   np.dot(self._T, D)).astype(self.dtype)
+        return getattr(self, name)
 
-        self._b = np.zeros(max_lv)
-        self._x_eigenvalues = np.zeros(max_lv)
-        self._y_eigenvalues = np.zeros(max_lv)
-        self._Y_modeled = np.zeros((self.n, self.p))
-        self._Y_modeled_dummy = np.zeros((self.n, self.p))
+    @property
+    def X(self):
+        """Return the X of the model, built here if it holds the pending
+           samples of a TrainingSet (see _LazyRows)."""
+        if isinstance(self._X, _LazyRows):
+            self._X = self._X.toarray()
+        return self._X
+
+    @X.setter
+    def X(self, value):
+        self._X = value
+
+    @property
+    def Y(self):
+        """Return the Y of the model, built here if pending like X."""
+        if isinstance(self._Y, _LazyRows):
+            self._Y = self._Y.toarray()
+        return self._Y
+
+    @Y.setter
+    def Y(self, value):
+        self._Y = value
 
     @property
     def nr_lv(self):
@@ -215,17 +852,173 @@ class Model(object):
                                          '{} out of bounds [0, {}]'.format(
                                              value, self.max_lv)
 
-        utility.clear_property_cache(self, 'Y_modeled')
-        utility.clear_property_cache(self, 'Y_modeled_dummy')
-        utility.clear_property_cache(self, 'E_x')
-        utility.clear_property_cache(self, 'E_y')
-        utility.clear_property_cache(self, 'B')
-        utility.clear_property_cache(self, 't_square')
-        utility.clear_property_cache(self, 'q_residuals_x')
-        utility.clear_property_cache(self, 'leverage')
-
+        # the cached properties keep a value per nr_lv, see _per_lv
         self._nr_lv = value
 
+    def _resize(self, max_lv):
+        """Shrink or grow the space of the model to max_lv latent variables.
+
+           Already computed latent variables are preserved, new ones are 0.
+        """
+        keep = min(max_lv, self.max_lv)
+        for name in ('_T', '_P', '_W', '_U', '_Q'):
+            old = getattr(self, name, None)
+            if old is None:  # scores not allocated, see update()
+                continue
+            new = np.zeros((old.shape[0], max_lv), dtype=old.dtype)
+            new[:, :keep] = old[:, :keep]
+            setattr(self, name, new)
+        for name in ('_b', 'iterations', 'saved_iterations',
+                     '_x_eigenvalues', '_y_eigenvalues'):
+            old = getattr(self, name)
+            new = np.zeros(max_lv, dtype=old.dtype)
+            new[:keep] = old[:keep]
+            setattr(self, name, new)
+
+        self.max_lv = max_lv
+        self.nr_lv = max_lv
+        utility.clear_property_cache(self)
+
+    def _gram_x(self):
+        """Return X'X, computed the first time and then kept, so that the
+           SIMPLS latent variables of tall X added by extend() do not need
+           it again."""
+        if self._XtX is None:
+            self._XtX = _gram(self.X)
+        return self._XtX
+
+    def extend(self, nr_lv, criteria=None, deflate=True, **kwargs):
+        """Compute nr_lv more latent variables and use all of them.
+
+           The already computed latent variables are kept: the new ones
+           continue from the residuals of X and Y (from the deflated X'Y
+           for SIMPLS models). The extension stops early if the given
+           StoppingCriteria are met, deflate has the same meaning it has
+           in nipals() and the keyword arguments are passed to the NIPALS
+           inner step (tol, max_iter, closed_form).
+
+           Return the number of latent variables actually added.
+        """
+        start = self.max_lv
+        stop = _bounded_nr_lv(self.n, self.m, start + nr_lv)
+        if stop <= start:
+            IO.Log.warning('The model has already the maximum number of '
+                           'latent variables ({})'.format(start))
+            return 0
+
+        T, P = self._T[:, :start], self._P[:, :start]
+        if criteria is not None:
+            criteria.start(_sum_of_squares(self.X),
+                           np.sum(np.power(self.Y, 2)))
+            for t_square, b in zip(np.sum(np.power(T, 2), axis=0),
+                                   self._b[:start]):
+                criteria.update(t_square, b)
+
+        self._resize(stop)
+        if self.engine == 'simpls':
+            V = np.zeros((self.m, stop), dtype=self.dtype)
+            if start > 0:
+                V[:, :start] = np.linalg.qr(P)[0]
+            cross_products = _simpls_cross_products(self)
+            S = self.X.T.dot(self.Y) if cross_products is None \
+                else cross_products[1].copy()
+            S -= np.dot(V, np.dot(V.T, S))
+            found = _simpls_latent_variables(self, S, V, start, stop,
+                                             criteria, cross_products)
+            if cross_products is not None:
+                _simpls_scores(self, start, found)
+        else:
+            # kernel and covariance engines give the same results of NIPALS
+            # with its inner step solved in closed form
+            if self.engine != 'nipals':
+                kwargs.setdefault('closed_form', True)
+            if deflate and isinstance(self.X, np.ndarray):
+                E_x = _DeflatedResiduals(self.X - np.dot(T, P.T))
+            else:
+                E_x = _ImplicitResiduals(self.X, self, start)
+            E_y = self.Y - np.dot(T * self._b[:start], self._Q[:, :start].T)
+            found = _nipals_latent_variables(self, E_x, E_y, start, stop,
+                                             criteria=criteria, **kwargs)
+        if found < stop:
+            self._resize(found)
+
+        IO.Log.info('Model extended from {} to {} latent '
+                    'variables'.format(start, self.max_lv))
+        return self.max_lv - start
+
+    def update(self, train_set):
+        """Refit the model on train_set after its update() or remove().
+
+           The latent variables are extracted again from the cross
+           products kept up to date by train_set, by the covariance PLS
+           kernel (NIPALS, kernel and covariance models are the same
+           model) or by SIMPLS, at a cost which does not depend on the
+           number of samples. The samples of train_set are not read: X, Y
+           and the scores T and U are built the first time they are used.
+           The engine of the model does not change.
+        """
+        nr_lv = _bounded_nr_lv(train_set.n, self.m, self.max_lv)
+        XtX, XtY, YtY = train_set.cross_products()
+        # train_set._x and ._y may hold pending samples, see _LazyRows
+        X, Y = train_set._x, train_set._y
+        if self.engine == 'simpls':
+            model = Model(X, Y, nr_lv, engine='simpls', scores=False)
+            V = np.zeros((self.m, nr_lv), dtype=model.dtype)
+            found = _simpls_latent_variables(model, XtY.copy(), V, 0, nr_lv,
+                                             cross_products=(XtX, XtY, YtY))
+            _check_latent_variables(found)
+            if found < nr_lv:
+                model._resize(found)
+            model._XtX = XtX
+            R, D = model._W, np.zeros((found, found), dtype=model.dtype)
+        else:
+            W, P, Q, b, R, reason = _covariance_kernel(XtX, XtY,
+                                                       np.diag(YtY), nr_lv)
+            model = Model(X, Y, b.shape[0], engine=self.engine,
+                          scores=False)
+            model.stop_reason = reason
+            model._W[:, :], model._P[:, :], model._Q[:, :] = W, P, Q
+            model._b[:] = b
+            D = _covariance_deflation(Q, b)
+            # t = X * r and u = Y * q - T * d, so their squared norms are
+            # r' * X'X * r and q' * Y'Y * q - 2 q' * Y'T * d + d' * T'T * d
+            TtT = np.dot(R.T, np.dot(XtX, R))
+            YtT = np.dot(XtY.T, R)
+            UtU = np.dot(Q.T, np.dot(YtY, Q)) - 2 * np.dot(
+                Q.T, np.dot(YtT, D)) + np.dot(D.T, np.dot(TtT, D))
+            model._x_eigenvalues[:] = np.diag(TtT) / (model.n - 1)
+            model._y_eigenvalues[:] = np.diag(UtU) / (model.n - 1)
+        model._score_weights = (R, D)
+
+        # the state of the refitted model replaces the old one, caches too
+        vars(self).clear()
+        vars(self).update(vars(model))
+        IO.Log.info('Model updated with {} samples'.format(model.n))
+
+    def remove(self, train_set, indices):
+        """Remove the samples at indices from train_set and refit the model.
+
+           The cross products of train_set are downdated and the latent
+           variables re-extracted from them as in update(). If either step
+           raises, neither train_set nor the model are changed.
+        """
+        indices = np.unique(np.asarray(indices, dtype=int))
+        # train_set.remove() replaces its attributes but the lists, whose
+        # removed entries are put back if the refit fails
+        state = dict(vars(train_set))
+        removed = [(i, train_set.categorical_y[i], train_set.body[i])
+                   for i in indices if 0 <= i < train_set.n]
+        train_set.remove(indices)
+        try:
+            self.update(train_set)
+        except Exception:
+            for i, category, row in removed:
+                train_set.categorical_y.insert(i, category)
+                train_set.body.insert(i, row)
+            vars(train_set).clear()
+            vars(train_set).update(state)
+            raise
+
     @property
     def T(self):
         return self._T[:, :self.nr_lv]
@@ -278,62 +1071,90 @@ class Model(object):
     def cumulative_explained_variance_y(self):
         return np.cumsum(self.explained_variance_y)
 
+    @utility.cached_property
+    def _W1_all(self):
+        """Return W1 for all the max_lv latent variables.
+
+           P' * W is upper triangular, so W1 = W * inv(P' * W) is found by
+           back-substitution, without inverting P' * W, and its first k
+           columns are W1 with k latent variables.
+        """
+        return scipy.linalg.solve_triangular(
+            np.dot(self._P.T, self._W), self._W.T, trans='T').T
+
     @property
     def W1(self):
         """W1 = W * inv(P' * W)"""
-        return self.W.dot(np.linalg.inv(self.P.T.dot(self.W)))
+        return self._W1_all[:, :self.nr_lv]
 
-    @utility.cached_property
+    @utility.cached_property(key=_per_lv)
     def Y_modeled(self):
         Y_modeled = self.X.dot(self.B)
         IO.Log.debug('Modeled Y prior to the discriminant classification',
                      Y_modeled)
         return Y_modeled
 
-    @utility.cached_property
+    @utility.cached_property(key=_per_lv)
     def Y_modeled_dummy(self):
-        dummy = [[1 if elem == max(row) else 0 for elem in row]
-                 for row in self.Y_modeled]
-        return np.array(dummy)
+        return argmax_rule(self.Y_modeled)
 
-    @utility.cached_property
+    @utility.cached_property(key=_per_lv)
     def E_x(self):
-        return self.X - np.dot(self.T, self.P.T)
+        return _dense(self.X) - np.dot(self.T, self.P.T)
 
-    @utility.cached_property
+    @utility.cached_property(key=_per_lv)
     def E_y(self):
         return self.Y - (self.T.dot(np.diag(self.b))).dot(self.Q.T)
 
-    @utility.cached_property
+    @utility.cached_property(key=_per_lv)
     def B(self):
-        """Compute regression parameters B."""
-        tmp = np.linalg.inv(self.P.T.dot(self.W))  # tmp is: (P'W)^{-1}
-        return ((self.W.dot(tmp)).dot(np.diag(self.b))).dot(self.Q.T)
+        """Compute regression parameters B = W1 * diag(b) * Q'."""
+        return np.dot(self.W1 * self.b, self.Q.T)
 
     @utility.cached_property
+    def B_all(self):
+        """Return the regression parameters for every number of latent
+           variables: B_all[:, :, k] is B with k + 1 latent variables.
+
+           B accumulates the contributions of the columns of W1 (see
+           _W1_all), without any inversion.
+        """
+        W1 = self._W1_all
+        return np.cumsum(W1[:, np.newaxis, :] * (self._Q * self._b), axis=2)
+
+    @utility.cached_property(key=_per_lv)
     def t_square(self):
-        lambda_inv = 1 / self.x_eigenvalues
-        return np.diag(self.T.dot(np.diag(lambda_inv)).dot(self.T.T))
+        return hotelling_t_square(self.T, self.x_eigenvalues)
 
-    @utility.cached_property
+    @utility.cached_property(key=_per_lv)
     def q_residuals_x(self):
         if self.nr_lv == self.max_lv:
             IO.Log.warning('Q residuals with max number of components are 0')
-        return np.diag(self.E_x.dot(self.E_x.T))
+        return q_residuals(self.X, self.T, self.P)
 
-    @utility.cached_property
+    @utility.cached_property(key=_per_lv)
     def leverage(self):
-        temp = np.linalg.inv(np.dot(self.U.T, self.U))
-        leverage = np.empty(self.n)
+        return leverage(self.U)
+
+    def predict(self, test_set_x, all_lv=False):
+        """Return Y predicted for the given test set over this model.
+
+           test_set_x may also be a scipy.sparse or a CenteredSparse matrix.
+           With all_lv the predictions for every number of latent
+           variables are returned, see predict_all().
+        """
+        if all_lv:
+            return self.predict_all(test_set_x)
+        return test_set_x.dot(self.B)
 
-        for j in range(self.p):
-            for i in range(self.n):
-                leverage[i] = self.U[i].dot(temp).dot(self.U[i].T)
-        return leverage
+    def predict_all(self, test_set_x):
+        """Return the n x p x max_lv Y predicted for the given test set with
+           every number of latent variables, nr_lv is not used.
 
-    def predict(self, test_set_x):
-        """Return Y predicted for the given test set over this model."""
-        return np.dot(test_set_x, self.B)
+           A single product of test_set_x with all the columns of B_all.
+        """
+        B_all = self.B_all.reshape(self.m, -1)
+        return test_set_x.dot(B_all).reshape(-1, self.p, self.max_lv)
 
 
 class Statistics(object):
@@ -380,166 +1201,1342 @@ class Statistics(object):
         return r_squared
 
 
-def nipals(X, Y, nr_lv=None, tol=1e-6, max_iter=1e4):
-    """Find the Principal Components with the NIPALS algorithm."""
+class LVStatistics(object):
+    """Calculate the statistics of Statistics for every number of latent
+       variables at once, from the predictions of Model.predict_all().
 
-    # Start with maximal residual (matrix X, matrix Y)
-    E_x = X.copy()
-    E_y = Y.copy()
+       Every statistic is a p x max_lv array, column k refers to k + 1
+       latent variables.
+    """
+
+    def __init__(self, y_real, y_pred_all):
+        """Save the real Y and the predicted Y of every lv."""
 
+        assert y_real.shape == y_pred_all.shape[:2], 'Y real and Y ' \
+            'predicted must have the same dimension'
+        self.y_real = y_real
+        self.y_pred_all = y_pred_all
+
+    @property
+    def p(self):
+        """Return the number of columns of y."""
+        return self.y_real.shape[1]
+
+    @property
+    def max_lv(self):
+        """Return the number of latent variables."""
+        return self.y_pred_all.shape[2]
+
+    @property
+    def ess(self):
+        mean = self.y_real.mean(axis=0)[:, np.newaxis]
+        return np.sum(np.power(self.y_pred_all - mean, 2), axis=0)
+
+    @property
+    def rss(self):
+        residuals = self.y_real[:, :, np.newaxis] - self.y_pred_all
+        return np.sum(np.power(residuals, 2), axis=0)
+
+    @property
+    def tss(self):
+        tss = np.sum(np.power(self.y_real - self.y_real.mean(axis=0), 2),
+                     axis=0)
+        return np.repeat(tss[:, np.newaxis], self.max_lv, axis=1)
+
+    @property
+    def rmsec(self):
+        return np.sqrt(self.rss / self.y_real.shape[0])
+
+    @property
+    def r_squared(self):
+        return 1 - self.rss / self.tss
+
+
+class CVStatistics(object):
+    """Statistics of a cross-validation, for every split, lv and y column.
+
+       rss and tss are those of the test samples of every split, n_test
+       their number, members the test samples of every class and errors
+       the members assigned by argmax_rule(ties='first') to another class.
+       All of them are splits x max_lv x p arrays, while the curves over
+       the lv (rmsecv, r_squared, error_rate) are p x max_lv arrays like
+       those of LVStatistics.
+    """
+
+    ARRAYS = ('rss', 'tss', 'n_test', 'errors', 'members')
+
+    def __init__(self, rss, tss, n_test, errors, members):
+        """Save the splits x max_lv x p arrays of the statistics.
+
+           Raise ValueError if their shapes differ.
+        """
+        arrays = [np.asarray(array) for array in
+                  (rss, tss, n_test, errors, members)]
+        if any(array.ndim != 3 or array.shape != arrays[0].shape
+               for array in arrays):
+            raise ValueError('The statistics of a cross-validation must be '
+                             'splits x max_lv x p arrays')
+        self.rss, self.tss, self.n_test, self.errors, self.members = arrays
+
+    @property
+    def splits(self):
+        """Return the number of splits."""
+        return self.rss.shape[0]
+
+    @property
+    def max_lv(self):
+        """Return the number of latent variables."""
+        return self.rss.shape[1]
+
+    @property
+    def p(self):
+        """Return the number of columns of y."""
+        return self.rss.shape[2]
+
+    @property
+    def rmsecv(self):
+        return np.sqrt(np.sum(self.rss, axis=0) /
+                       np.sum(self.n_test, axis=0)).T
+
+    @property
+    def r_squared(self):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return (1 - np.sum(self.rss, axis=0) /
+                    np.sum(self.tss, axis=0)).T
+
+    @property
+    def error_rate(self):
+        """Return the fraction of misclassified members of every class,
+           nan for classes never tested."""
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return (np.sum(self.errors, axis=0) /
+                    np.sum(self.members, axis=0)).T
+
+    def save(self, filename):
+        """Save all the arrays in the .npz file filename."""
+        np.savez(filename, **{name: getattr(self, name)
+                              for name in self.ARRAYS})
+
+    @staticmethod
+    def load(filename):
+        """Return the CVStatistics saved by save() in filename."""
+        with np.load(filename) as data:
+            return CVStatistics(*(data[name]
+                                  for name in CVStatistics.ARRAYS))
+
+
+def _split_statistics(y_real, y_pred_all):
+    """Return the max_lv x p arrays of CVStatistics of a single split."""
+    stats = LVStatistics(y_real, y_pred_all)
+    real_class = np.argmax(y_real, axis=1)
+    members = np.zeros(y_real.shape, dtype=int)
+    members[np.arange(len(real_class)), real_class] = 1
+    wrong = np.argmax(y_pred_all, axis=1) != real_class[:, np.newaxis]
+    shape = (stats.max_lv, stats.p)
+    return (stats.rss.T, stats.tss.T, np.full(shape, len(y_real)),
+            np.dot(wrong.T, members), np.broadcast_to(members.sum(axis=0),
+                                                      shape))
+
+
+def _cv_statistics(splits):
+    """Return the CVStatistics of the _split_statistics() of every split."""
+    return CVStatistics(*(np.stack(arrays) for arrays in zip(*splits)))
+
+
+def nipals(X, Y, nr_lv=None, tol=1e-6, max_iter=1e4, closed_form=False,
+           criteria=None, deflate=True, warm_start=None):
+    """Find the Principal Components with the NIPALS algorithm.
+
+       With closed_form the power iteration of every latent variable is
+       replaced by the direct solution of its fixed point: the dominant
+       eigenvector of the p x p matrix E_y' * E_x * E_x' * E_y.
+       The number of inner iterations per latent variable is saved in
+       model.iterations (0 means closed form).
+
+       The extraction stops before nr_lv latent variables if the given
+       StoppingCriteria are met, model.stop_reason tells why it stopped.
+
+       Without deflate the residuals of X are never built: X is left
+       untouched and the deflation is applied implicitly through the
+       scores and the loadings already found, E_x = X - T * P'. This costs
+       some more flops per product but needs no copy of X.
+       Sparse X (scipy.sparse or CenteredSparse) and BlockedMatrix X are
+       never deflated.
+
+       warm_start is a Model of similar data (e.g. before some samples
+       were added): the power iteration of every latent variable starts
+       from its U column (or from its W column if the number of samples
+       differs) instead of the column of E_y with maximum variance.
+       model.saved_iterations estimates the iterations spared, comparing
+       with those the warm_start model needed from a cold start (it stays
+       0 if warm_start has no iteration counts, e.g. closed_form ones).
+       Raise ValueError if warm_start has not the same predictors of X.
+    """
     assert X.shape[0] == Y.shape[0], "Incompatible X and Y matrices"
+    if warm_start is not None and warm_start.m != X.shape[1]:
+        raise ValueError('The warm start model has {} predictors instead '
+                         'of {}'.format(warm_start.m, X.shape[1]))
 
     n = X.shape[0]
     m = X.shape[1]
-    p = Y.shape[1]
-
-    if nr_lv is None:
-        nr_lv = min(n, m)
-    if nr_lv > min(n, m):
-        IO.Log.warning('Too many latent variables specified. '
-                       'Will use {}'.format(min(n, m)))
-        nr_lv = min(n, m)
 
+    nr_lv = _bounded_nr_lv(n, m, nr_lv)
     model = Model(X, Y, nr_lv)
 
-    s_list_x = []
-    s_list_y = []
+    # Start with maximal residual (matrix X, matrix Y)
+    if deflate and isinstance(X, np.ndarray):
+        E_x = _DeflatedResiduals(X.copy())
+    else:
+        E_x = _ImplicitResiduals(X, model)
+    E_y = Y.copy()
+    if not np.any(E_x.tdot(E_y)):
+        _check_latent_variables(0)
+
+    if criteria is not None:
+        criteria.start(_sum_of_squares(X), np.sum(np.power(Y, 2)))
+    found = _nipals_latent_variables(model, E_x, E_y, 0, nr_lv, tol,
+                                     max_iter, closed_form, criteria,
+                                     warm_start)
+    if found < nr_lv:
+        model._resize(found)
+    if warm_start is not None and not closed_form:
+        k = min(found, warm_start.max_lv)
+        cold_iterations = warm_start.iterations[:k] + \
+            warm_start.saved_iterations[:k]
+        # a power iteration runs at least once, 0 means an unknown count
+        if np.all(cold_iterations > 0):
+            model.saved_iterations[:k] = cold_iterations - \
+                model.iterations[:k]
+            IO.Log.info('NIPALS warm start saved {} '
+                        'iterations'.format(np.sum(model.saved_iterations)))
 
-    # Loop for each possible LV
-    for i in range(nr_lv):
-        # Initialize u as a column of E_x with maximum variance
-        max_var_index = np.argmax(np.sum(np.power(E_y, 2), axis=0))
-        u = E_y[:, max_var_index].copy()
-
-        for it in range(int(max_iter) + 2):
-            # Evaluate w as projection of u in X and normalize it
-            w = np.dot(E_x.T, u) / np.dot(u, u)
-            w /= np.linalg.norm(w)
-            # Evaluate t as projection of w in X
-            # t = np.dot(E_x, w) / np.dot(w, w)
-            t = np.dot(E_x, w)
-
-            # Y part
-            # Evaluate q as projection of t in Y and normalize it
-            # q = np.dot(E_y.T, t) / np.dot(t, t)
-            q = np.dot(E_y.T, t)
-            q /= np.linalg.norm(q)
-
-            # Evaluate u_star as projection of c in Y
-            u_star = np.dot(E_y, q) / np.dot(q, q)
-
-            diff = u_star - u
-            delta_u = np.dot(diff, diff)
-            if it > 1 and delta_u < tol:
-                break
-            u = u_star
+    IO.Log.info('NIPALS loadings shape', model.P.shape)
+    IO.Log.info('NIPALS scores shape', model.T.shape)
+    IO.Log.info('NIPALS x_eigenvalues', model.x_eigenvalues)
+    IO.Log.info('NIPALS iterations', model.iterations)
+    IO.Log.info('NIPALS stopped by {}'.format(model.stop_reason))
+
+    return model
+
+
+def out_of_core_nipals(source, Y, nr_lv=None, block_size=1024, mean=None,
+                       sigma=None, **kwargs):
+    """Run NIPALS on a X too big for the memory, see BlockedMatrix.
+
+       X is streamed in blocks of block_size rows from source, a
+       numpy.memmap or a callable returning an iterator over row blocks,
+       and preprocessed on the fly with mean and sigma (see
+       BlockedMatrix.statistics). Y must fit in memory. The model keeps
+       only scores and loadings, no copy of X nor of its residuals.
+       The keyword arguments are passed to nipals().
+    """
+    kwargs['deflate'] = False
+    return nipals(BlockedMatrix(source, block_size, mean, sigma), Y, nr_lv,
+                  **kwargs)
+
+
+def _nipals_latent_variables(model, E_x, E_y, start, stop, tol=1e-6,
+                             max_iter=1e4, closed_form=False, criteria=None,
+                             warm_start=None):
+    """Fill the latent variables [start, stop) of model with NIPALS.
+
+       E_x (_DeflatedResiduals or _ImplicitResiduals) and E_y are the
+       residuals left by the first start latent variables and are deflated
+       in place. The power iterations start from the latent variables of
+       the warm_start model, if any.
+       Return the number of latent variables in the model, which is lower
+       than stop if the criteria are met.
+    """
+    for i in range(start, stop):
+        if closed_form:
+            w, t, q, u = _nipals_closed_form(E_x, E_y)
         else:
-            IO.Log.warning('Reached max '
-                           'iteration number ({})'.format(max_iter))
-            IO.Log.warning('NIPALS iteration: {}\n'
-                           '       difference: {:.5e}'.format(it, delta_u))
+            w, t, q, u, model.iterations[i] = _nipals_power_iteration(
+                E_x, E_y, tol, max_iter,
+                _nipals_warm_start(warm_start, i, E_x, E_y))
 
         # Save the evaluated values
-        p = np.dot(E_x.T, t) / np.dot(t, t)
+        p = E_x.tdot(t) / np.dot(t, t)
         p_norm = np.linalg.norm(p)
         p = p / p_norm
         t = t * p_norm
         w = w * p_norm
 
+        # regression coefficient for the inner relation
+        model._b[i] = np.dot(u.T, t) / np.dot(t, t)
+
+        model._P[:, i] = p
+        model._T[:, i] = t
+        model._W[:, i] = w
+        model._U[:, i] = u
+        model._Q[:, i] = q
+
+        # Calculate residuals
+        E_x.deflate(t, p)
+        E_y -= model._b[i] * np.dot(np.row_stack(t),
+                                    np.column_stack(q.T))
+        model._x_eigenvalues[i] = np.dot(t, t) / (model.n - 1)
+        model._y_eigenvalues[i] = np.dot(u, u) / (model.n - 1)
+
+        if criteria is not None:
+            model.stop_reason = criteria.update(np.dot(t, t), model._b[i])
+            if model.stop_reason is not None:
+                return i + 1
+
+    model.stop_reason = 'max_lv'
+    return stop
+
+
+class _DeflatedResiduals(object):
+    """Residuals of X explicitly deflated after every latent variable."""
+
+    def __init__(self, E_x):
+        self.E_x = E_x
+
+    def dot(self, v):
+        """Return E_x * v."""
+        return np.dot(self.E_x, v)
+
+    def tdot(self, u):
+        """Return E_x' * u."""
+        return np.dot(self.E_x.T, u)
+
+    def deflate(self, t, p):
+        """Remove the latent variable with scores t and loadings p."""
+        self.E_x -= np.dot(np.row_stack(t), np.column_stack(p))
+
+
+class _ImplicitResiduals(object):
+    """Residuals of X never built, E_x = X - T * P' is applied on the fly.
+
+       T and P are read from the model, so only the latent variables
+       already stored in it are subtracted.
+    """
+
+    def __init__(self, X, model, nr_lv=0):
+        self.X = X
+        self.model = model
+        self.nr_lv = nr_lv
+
+    def dot(self, v):
+        """Return E_x * v."""
+        T, P = self.model._T[:, :self.nr_lv], self.model._P[:, :self.nr_lv]
+        return self.X.dot(v) - np.dot(T, np.dot(P.T, v))
+
+    def tdot(self, u):
+        """Return E_x' * u."""
+        T, P = self.model._T[:, :self.nr_lv], self.model._P[:, :self.nr_lv]
+        return self.X.T.dot(u) - np.dot(P, np.dot(T.T, u))
+
+    def deflate(self, t, p):
+        """Account the latent variable just stored in the model."""
+        self.nr_lv += 1
+
+
+def _nipals_start(E_y):
+    """Return the column of E_y with maximum variance."""
+    max_var_index = np.argmax(np.sum(np.power(E_y, 2), axis=0))
+    return E_y[:, max_var_index].copy()
+
+
+def _nipals_warm_start(warm_start, i, E_x, E_y):
+    """Return the u to start the latent variable i from, None if the
+       warm_start model has not such a latent variable."""
+    if warm_start is None or i >= warm_start.max_lv:
+        return None
+    if warm_start.n == E_y.shape[0]:
+        return warm_start._U[:, i].copy()
+    # u of the current samples predicted by the old weights
+    q = np.dot(E_y.T, E_x.dot(warm_start._W[:, i]))
+    return np.dot(E_y, q / np.linalg.norm(q))
+
+
+def _nipals_power_iteration(E_x, E_y, tol, max_iter, u=None):
+    """Return (w, t, q, u, iterations) of the NIPALS power method.
+
+       The iteration starts from the given u, if any.
+    """
+    if u is None:
+        # Initialize u as a column of E_x with maximum variance
+        u = _nipals_start(E_y)
+
+    for it in range(int(max_iter) + 2):
+        # Evaluate w as projection of u in X and normalize it
+        w = E_x.tdot(u) / np.dot(u, u)
+        w /= np.linalg.norm(w)
+        # Evaluate t as projection of w in X
+        # t = np.dot(E_x, w) / np.dot(w, w)
+        t = E_x.dot(w)
+
+        # Y part
+        # Evaluate q as projection of t in Y and normalize it
+        # q = np.dot(E_y.T, t) / np.dot(t, t)
+        q = np.dot(E_y.T, t)
+        q /= np.linalg.norm(q)
+
+        # Evaluate u_star as projection of c in Y
+        u_star = np.dot(E_y, q) / np.dot(q, q)
+
+        diff = u_star - u
+        delta_u = np.dot(diff, diff)
+        if it > 1 and delta_u < tol:
+            break
+        u = u_star
+    else:
+        IO.Log.warning('Reached max '
+                       'iteration number ({})'.format(max_iter))
+        IO.Log.warning('NIPALS iteration: {}\n'
+                       '       difference: {:.5e}'.format(it, delta_u))
+
+    return w, t, q, u, it + 1
+
+
+def _nipals_closed_form(E_x, E_y):
+    """Return (w, t, q, u) of the current NIPALS latent variable.
+
+       w is the dominant left singular vector of E_x' * E_y, found through
+       the eigenvectors of the p x p matrix (E_x' * E_y)' * (E_x' * E_y).
+       Its sign is the one the power iteration would converge to.
+    """
+    XtY = E_x.tdot(E_y)
+    if XtY.shape[1] == 1:
+        w = XtY[:, 0].copy()
+    else:
+        eigvals, eigvecs = np.linalg.eigh(np.dot(XtY.T, XtY))
+        w = np.dot(XtY, eigvecs[:, -1])
+    if np.dot(w, E_x.tdot(_nipals_start(E_y))) < 0:
+        w = -w
+    w /= np.linalg.norm(w)
+    t = E_x.dot(w)
+
+    q = np.dot(E_y.T, t)
+    q /= np.linalg.norm(q)
+    u = np.dot(E_y, q)
+
+    return w, t, q, u
+
+
+def simpls(X, Y, nr_lv=None, criteria=None):
+    """Find the latent variables with the SIMPLS algorithm (de Jong, 1993).
+
+       Instead of deflating the n x m residual matrix of X, like nipals()
+       does, only the m x p cross-product matrix X'Y is deflated against
+       an orthonormal basis of the loadings found so far.
+       The m x m matrix X'X is built (and kept for extend()) only for tall
+       X, m <= n; for wide X the scores are computed one at a time from X,
+       in O(n + m) memory (see _simpls_latent_variables()).
+
+       The returned model follows the same conventions of nipals(): P and Q
+       have unit length columns, b holds the inner relation coefficients and
+       W is scaled so that W * inv(P' * W) are the SIMPLS weights.
+
+       The extraction stops before nr_lv latent variables if the given
+       StoppingCriteria are met, model.stop_reason tells why it stopped.
+    """
+    assert X.shape[0] == Y.shape[0], "Incompatible X and Y matrices"
+
+    n = X.shape[0]
+    m = X.shape[1]
+
+    nr_lv = _bounded_nr_lv(n, m, nr_lv)
+    model = Model(X, Y, nr_lv, engine='simpls')
+
+    # Cross-product matrix and orthonormal basis of the deflation subspace
+    cross_products = _simpls_cross_products(model)
+    S = X.T.dot(Y) if cross_products is None else cross_products[1].copy()
+    V = np.zeros((m, nr_lv), dtype=model.dtype)
+
+    if criteria is not None:
+        criteria.start(_sum_of_squares(X), np.sum(np.power(Y, 2)))
+    found = _simpls_latent_variables(model, S, V, 0, nr_lv, criteria,
+                                     cross_products)
+    _check_latent_variables(found)
+    if cross_products is not None:
+        _simpls_scores(model, 0, found)
+    if found < nr_lv:
+        model._resize(found)
+
+    IO.Log.info('SIMPLS loadings shape', model.P.shape)
+    IO.Log.info('SIMPLS scores shape', model.T.shape)
+    IO.Log.info('SIMPLS x_eigenvalues', model.x_eigenvalues)
+    IO.Log.info('SIMPLS stopped by {}'.format(model.stop_reason))
+
+    return model
+
+
+def kernel_pls(X, Y, nr_lv=None, criteria=None):
+    """Find the latent variables working on the n x n kernel matrix XX'.
+
+       Meant for wide datasets (m >> n): every latent variable is extracted
+       from the deflated kernel and from the residuals of Y, so its cost
+       depends on n and not on m. The weights of each latent variable are
+       the dominant eigenvector of the small p x p matrix E_y' * K * E_y,
+       the same fixed point reached by nipals().
+
+       X is only needed to build the kernel at the beginning and to compute
+       all the loadings P and the weights W at the end.
+
+       The extraction stops before nr_lv latent variables if the given
+       StoppingCriteria are met, model.stop_reason tells why it stopped.
+    """
+    assert X.shape[0] == Y.shape[0], "Incompatible X and Y matrices"
+
+    n = X.shape[0]
+    m = X.shape[1]
+
+    nr_lv = _bounded_nr_lv(n, m, nr_lv)
+    model = Model(X, Y, nr_lv, engine='kernel')
+
+    K = _outer_gram(X)
+    E_y = Y.copy()
+    # u' * K * u below is the squared norm of X' * E_y * q
+    min_u_square = _min_cross_product_square(model.dtype, m, model.p,
+                                             np.sum(Y * np.dot(K, Y)))
+    if criteria is not None:
+        criteria.start(np.trace(K), np.sum(np.power(Y, 2)))
+    model.stop_reason = 'max_lv'
+
+    s_list_x = []
+    s_list_y = []
+    w_scale = []  # to map X' * (deflated u) in the nipals weights
+
+    for i in range(nr_lv):
+        # Starting vector of nipals(), only used to choose the sign
+        max_var_index = np.argmax(np.sum(np.power(E_y, 2), axis=0))
+        u_start = E_y[:, max_var_index]
+
+        eigvals, eigvecs = np.linalg.eigh(np.dot(E_y.T, np.dot(K, E_y)))
+        q = eigvecs[:, -1]
+        u = np.dot(E_y, q)
+        t = np.dot(K, u)
+
+        u_square = np.dot(u, t)  # squared norm of the unscaled weights
+        if u_square <= min_u_square:
+            IO.Log.warning('Kernel PLS found only {} latent variables, X\'Y '
+                           'is exhausted (X is rank deficient)'.format(i))
+            model.stop_reason = 'rank'
+            break
+        if np.dot(t, u_start) < 0:
+            q, u, t = -q, -u, -t
+
+        t /= np.sqrt(u_square)
+        Kt = np.dot(K, t)
+        t_square = np.dot(t, t)
+        p_norm = np.sqrt(np.dot(t, Kt)) / t_square
+        t = t * p_norm
+        t_square = np.dot(t, t)
+        Kt *= p_norm
+
         s_list_x.append(np.linalg.norm(t))
         s_list_y.append(np.linalg.norm(u))
+        w_scale.append(p_norm / np.sqrt(u_square))
         # regression coefficient for the inner relation
-        model.b[i] = np.dot(u.T, t) / np.dot(t, t)
+        model.b[i] = np.dot(u, t) / t_square
 
-        # Calculate residuals
-        E_x -= np.dot(np.row_stack(t), np.column_stack(p))
-        E_y -= model.b[i] * np.dot(np.row_stack(t),
-                                   np.column_stack(q.T))
+        # Deflate the kernel: K = (I - tt'/t't) K (I - tt'/t't)
+        tKt = np.dot(t, Kt) / t_square
+        K -= (np.outer(t, Kt) + np.outer(Kt, t)) / t_square
+        K += np.outer(t, t) * (tKt / t_square)
+        E_y -= model.b[i] * np.outer(t, q)
 
-        model.P[:, i] = p
         model.T[:, i] = t
-        model.W[:, i] = w
         model.U[:, i] = u
         model.Q[:, i] = q
 
+        if criteria is not None:
+            reason = criteria.update(t_square, model.b[i])
+            if reason is not None:
+                model.stop_reason = reason
+                break
+
+    _check_latent_variables(len(s_list_x))
+    if len(s_list_x) < nr_lv:
+        model._resize(len(s_list_x))
+    T, U = model.T, model.U
+
+    # Loadings and weights in the X space, from the undeflated X:
+    # p = X' t / t't  and  w ~ X' (u deflated by the previous scores)
+    t_squares = np.sum(np.power(T, 2), axis=0)
+    model.P[:, :] = X.T.dot(T) / t_squares
+    proj = np.triu(np.dot(T.T, U), k=1) / t_squares[:, np.newaxis]
+    model.W[:, :] = X.T.dot(U - np.dot(T, proj)) * np.array(w_scale)
+
     model._x_eigenvalues = np.power(np.array(s_list_x), 2) / (model.n - 1)
     model._y_eigenvalues = np.power(np.array(s_list_y), 2) / (model.n - 1)
 
-    IO.Log.info('NIPALS loadings shape', model.P.shape)
-    IO.Log.info('NIPALS scores shape', model.T.shape)
-    IO.Log.info('NIPALS x_eigenvalues', model.x_eigenvalues)
+    IO.Log.info('Kernel PLS loadings shape', model.P.shape)
+    IO.Log.info('Kernel PLS scores shape', model.T.shape)
+    IO.Log.info('Kernel PLS x_eigenvalues', model.x_eigenvalues)
+    IO.Log.info('Kernel PLS stopped by {}'.format(model.stop_reason))
 
     return model
 
 
-def cross_validation(train_set, split, sample, max_lv):
-    """Perform a cross-validation procedure on a TrainingSet dataset.
+def covariance_pls(X, Y, nr_lv=None, criteria=None):
+    """Find the latent variables working on the matrices X'X and X'Y.
+
+       Meant for tall datasets (n >> m): the m x m and m x p cross-products
+       are computed once and every latent variable is extracted from them
+       (Dayal and MacGregor, 1997), so its cost does not depend on n.
+       The results are the same of nipals(); only the scores T and U need
+       a final pass over X and Y.
+
+       The extraction stops before nr_lv latent variables if the given
+       StoppingCriteria are met, model.stop_reason tells why it stopped.
+    """
+    assert X.shape[0] == Y.shape[0], "Incompatible X and Y matrices"
+
+    n = X.shape[0]
+    m = X.shape[1]
+
+    nr_lv = _bounded_nr_lv(n, m, nr_lv)
+    model = _covariance_model(X, Y, *_covariance_kernel(
+        _gram(X), X.T.dot(Y), np.sum(np.power(Y, 2), axis=0),
+        nr_lv, criteria))
 
-    Return a list of lists of Statistics object. Every element of the inner
-    list belongs to a different lv, while every element of the outer list
-    belongs ro a split.
+    s_list_x = np.linalg.norm(model.T, axis=0)
+    s_list_y = np.linalg.norm(model.U, axis=0)
+    model._x_eigenvalues = np.power(s_list_x, 2) / (model.n - 1)
+    model._y_eigenvalues = np.power(s_list_y, 2) / (model.n - 1)
+
+    IO.Log.info('Covariance PLS loadings shape', model.P.shape)
+    IO.Log.info('Covariance PLS scores shape', model.T.shape)
+    IO.Log.info('Covariance PLS x_eigenvalues', model.x_eigenvalues)
+    IO.Log.info('Covariance PLS stopped by {}'.format(model.stop_reason))
+
+    return model
 
-    Example:
-    [['split 0 lv 0', 'split 0 lv 1', 'split 0 lv 2'], ['split 1 lv 0',
-    'split 1 lv 1', 'split 1 lv 2']]
+
+def _covariance_model(X, Y, W, P, Q, b, R, reason):
+    """Return the Model of X and Y with the latent variables found by
+       _covariance_kernel(), eigenvalues excluded."""
+    model = Model(X, Y, b.shape[0], engine='covariance')
+    model.stop_reason = reason
+    model.W[:, :] = W
+    model.P[:, :] = P
+    model.Q[:, :] = Q
+    model.b[:] = b
+    model.T[:, :] = X.dot(R)
+    # u_i = E_y * q_i, with E_y deflated by the previous latent variables
+    model.U[:, :] = np.dot(Y, Q) - np.dot(model.T, _covariance_deflation(Q, b))
+    return model
+
+
+def _covariance_deflation(Q, b):
+    """Return the upper triangular D such that U = Y * Q - T * D."""
+    return np.triu(np.dot(np.diag(b), np.dot(Q.T, Q)), k=1)
+
+
+def _covariance_kernel(XtX, XtY, y_ss, nr_lv, criteria=None):
+    """Extract at most nr_lv latent variables from X'X and X'Y.
+
+       y_ss are the sums of squares of the columns of Y, they are needed
+       to choose the sign of the weights like nipals() does.
+
+       Return (W, P, Q, b, R, stop_reason) following the conventions of
+       nipals(), R are the weights to compute the scores from the
+       undeflated X (T = X * R).
+    """
+    m = XtX.shape[0]
+    p = XtY.shape[1]
+
+    dtype = np.result_type(XtX.dtype, XtY.dtype, np.float32)
+    XtY = XtY.copy()
+    y_ss = np.array(y_ss, dtype=dtype)
+    min_t_square = np.finfo(dtype).eps * np.trace(XtX)
+    if criteria is not None:
+        criteria.start(np.trace(XtX), np.sum(y_ss))
+
+    W = np.zeros((m, nr_lv), dtype=dtype)
+    P = np.zeros((m, nr_lv), dtype=dtype)
+    Q = np.zeros((p, nr_lv), dtype=dtype)
+    R = np.zeros((m, nr_lv), dtype=dtype)
+    b = np.zeros(nr_lv, dtype=dtype)
+
+    for i in range(nr_lv):
+        # nipals() starts from the column of E_y with maximum variance and
+        # X'E_y is exactly the deflated X'Y
+        start = XtY[:, np.argmax(y_ss)]
+
+        if p == 1:
+            w = XtY[:, 0].copy()
+        else:
+            eigvals, eigvecs = np.linalg.eigh(np.dot(XtY.T, XtY))
+            w = np.dot(XtY, eigvecs[:, -1])
+        w_norm = np.linalg.norm(w)
+        if w_norm > 0:
+            w /= w_norm
+        if np.dot(w, start) < 0:
+            w = -w
+
+        # weights for the undeflated X
+        r = w - np.dot(R[:, :i], np.dot(P[:, :i].T, w))
+        XtXr = np.dot(XtX, r)
+        t_square = np.dot(r, XtXr)
+        if t_square <= min_t_square:
+            _check_latent_variables(i)
+            IO.Log.warning('Covariance PLS found only {} latent variables, '
+                           'X is rank deficient'.format(i))
+            return W[:, :i], P[:, :i], Q[:, :i], b[:i], R[:, :i], 'rank'
+
+        p_i = XtXr / t_square
+        c = np.dot(r, XtY) / t_square
+        XtY -= np.outer(p_i, c) * t_square
+        y_ss -= np.power(c, 2) * t_square
+
+        p_norm = np.linalg.norm(p_i)
+        P[:, i] = p_i / p_norm
+        W[:, i] = w * p_norm
+        R[:, i] = r * p_norm
+        # c is the regression of Y over t, with t scaled by p_norm too
+        b[i] = np.linalg.norm(c) / p_norm
+        Q[:, i] = c / np.linalg.norm(c) if b[i] > 0 else c
+
+        if criteria is not None:
+            reason = criteria.update(t_square * p_norm ** 2, b[i])
+            if reason is not None:
+                k = i + 1
+                return W[:, :k], P[:, :k], Q[:, :k], b[:k], R[:, :k], reason
+
+    return W, P, Q, b, R, 'max_lv'
+
+
+def _simpls_latent_variables(model, S, V, start, stop, criteria=None,
+                             cross_products=None):
+    """Fill the latent variables [start, stop) of model with SIMPLS.
+
+       S is the cross-product X'Y deflated by the first start latent
+       variables and V the orthonormal basis of their loadings, both are
+       updated in place.
+       With the cross_products (X'X, X'Y, Y'Y) of X and Y (for tall X, see
+       _simpls_cross_products()) every latent variable is extracted from
+       them alone in O(m^2 + m * p) time and X and Y are not read: the
+       scores are left to _simpls_scores(). Without them (for wide X) the
+       scores t = X * w of every latent variable are computed directly, in
+       O(n * m) time, and no m x m matrix is ever built.
+       Return the number of latent variables in the model, which is lower
+       than stop if X is rank deficient or if the criteria are met.
+    """
+    if cross_products is None:
+        X, Y = model.X, model.Y
+        XtX, XtY = None, X.T.dot(Y)
+    else:
+        XtX, XtY, YtY = cross_products
+    min_s_square = _min_cross_product_square(model.dtype, model.m, model.p,
+                                             np.sum(np.power(XtY, 2)))
+
+    model.stop_reason = 'max_lv'
+    found = stop
+    for i in range(start, stop):
+        # The dominant left singular vector of S is obtained from the
+        # eigenvector of the small p x p matrix S'S
+        eigvals, eigvecs = np.linalg.eigh(np.dot(S.T, S))
+        if eigvals[-1] <= min_s_square:
+            IO.Log.warning('SIMPLS found only {} latent variables, X\'Y is '
+                           'exhausted (X is rank deficient)'.format(i))
+            model.stop_reason = 'rank'
+            found = i
+            break
+        w = np.dot(S, eigvecs[:, -1])
+
+        # t = X * w, so t't = w' * X'X * w and X't = X'X * w
+        if XtX is None:
+            t = X.dot(w)
+            t_square = np.dot(t, t)
+            XtXw = X.T.dot(t)
+        else:
+            XtXw = np.dot(XtX, w)
+            t_square = np.dot(w, XtXw)
+
+        p = XtXw / t_square
+        p_norm = np.linalg.norm(p)
+        p = p / p_norm
+        w = w * p_norm
+        t_square *= p_norm ** 2
+        if XtX is None:
+            t *= p_norm
+
+        # Regression of Y over the score t: c = b * q with q of unit length
+        c = np.dot(XtY.T, w) / t_square
+        b = np.linalg.norm(c)
+        q = c / b if b > 0 else c
+
+        # Deflate S with the new loading orthogonalized on the previous ones
+        v = p - np.dot(V[:, :i], np.dot(V[:, :i].T, p))
+        v /= np.linalg.norm(v)
+        V[:, i] = v
+        S -= np.outer(v, np.dot(v, S))
+
+        model._b[i] = b
+        model._P[:, i] = p
+        model._W[:, i] = w
+        model._Q[:, i] = q
+        model._x_eigenvalues[i] = t_square / (model.n - 1)
+        if XtX is None:
+            u = np.dot(Y, q)
+            model._T[:, i] = t
+            model._U[:, i] = u
+            u_square = np.dot(u, u)
+        else:
+            # u = Y * q, so u'u = q' * Y'Y * q
+            u_square = np.dot(q, np.dot(YtY, q))
+        model._y_eigenvalues[i] = u_square / (model.n - 1)
+
+        if criteria is not None:
+            reason = criteria.update(t_square, b)
+            if reason is not None:
+                model.stop_reason = reason
+                found = i + 1
+                break
+
+    return found
+
+
+def _simpls_cross_products(model):
+    """Return the (X'X, X'Y, Y'Y) of a tall model (m <= n) for
+       _simpls_latent_variables(), X'X is kept by the model, or None for a
+       wide model, whose scores are computed from X."""
+    if model.m > model.n:
+        return None
+    return model._gram_x(), model.X.T.dot(model.Y), np.dot(model.Y.T,
+                                                           model.Y)
+
+
+def _simpls_scores(model, start, stop):
+    """Fill the scores [start, stop) of a SIMPLS model extracted from its
+       cross products: the SIMPLS weights apply to the undeflated X, so
+       T = X * W and U = Y * Q."""
+    model._T[:, start:stop] = model.X.dot(model._W[:, start:stop])
+    model._U[:, start:stop] = np.dot(model.Y, model._Q[:, start:stop])
+
+
+def _check_latent_variables(found):
+    """Raise ValueError if no latent variable was found: X'Y is null (e.g.
+       Y has a single category, null once centered) and every engine would
+       return an empty model."""
+    if found == 0:
+        raise ValueError('No latent variable can be extracted, X\'Y is '
+                         'null')
+
+
+def _min_cross_product_square(dtype, m, p, xty_square):
+    """Return the squared norm below which the deflated X'Y is only round
+       off, given the squared norm xty_square of the undeflated X'Y.
+
+       It vanishes once the latent variables span the rank of X (or all
+       Y is explained) and is used by SIMPLS and kernel PLS to stop.
+    """
+    return np.finfo(dtype).eps ** 2 * m * p * xty_square
+
+
+ENGINES = {'covariance': covariance_pls,
+           'kernel': kernel_pls,
+           'nipals': nipals,
+           'simpls': simpls}
+
+
+def fit(X, Y, nr_lv=None, engine='nipals', **kwargs):
+    """Build a model over X and Y with the chosen engine of ENGINES.
+
+       Raise ValueError if engine is not a known engine name or if no
+       latent variable can be extracted (X'Y is null).
+    """
+    if engine not in ENGINES:
+        raise ValueError('The given engine ({}) is not valid, choose one '
+                         'of: {}.'.format(engine, ', '.join(sorted(ENGINES))))
+    return ENGINES[engine](X, Y, nr_lv=nr_lv, **kwargs)
+
+
+def precision_report(X, Y, dtype=np.float32, engine='nipals', **kwargs):
+    """Compare a model computed in dtype with the float64 reference one.
+
+       Return a dictionary of arrays with one value for every number of
+       latent variables:
+         'B'               max relative error of the regression parameters
+         'Y_modeled'       max absolute error of the modeled Y
+         'classification'  fraction of samples assigned to the same class
+    """
+    reference = fit(np.asarray(X, dtype=np.float64),
+                    np.asarray(Y, dtype=np.float64), engine=engine, **kwargs)
+    reduced = fit(np.asarray(X, dtype=dtype), np.asarray(Y, dtype=dtype),
+                  engine=engine, **kwargs)
+
+    max_lv = min(reference.max_lv, reduced.max_lv)
+    report = {'B': np.zeros(max_lv), 'Y_modeled': np.zeros(max_lv),
+              'classification': np.zeros(max_lv)}
+    for i in range(max_lv):
+        reference.nr_lv = reduced.nr_lv = i + 1
+        report['B'][i] = np.max(np.abs(reduced.B - reference.B)) / \
+            np.max(np.abs(reference.B))
+        report['Y_modeled'][i] = np.max(np.abs(reduced.Y_modeled -
+                                               reference.Y_modeled))
+        report['classification'][i] = np.mean(
+            np.argmax(reduced.Y_modeled, axis=1) ==
+            np.argmax(reference.Y_modeled, axis=1))
+
+    IO.Log.info('Precision of {} against float64 (rows: B, Y modeled, '
+                'classification)'.format(np.dtype(dtype).name),
+                np.array([report['B'], report['Y_modeled'],
+                          report['classification']]))
+    return report
+
+
+def _bounded_nr_lv(n, m, nr_lv):
+    """Return nr_lv or min(n, m) if it is None or greater than min(n, m)."""
+    if nr_lv is None:
+        return min(n, m)
+    if nr_lv > min(n, m):
+        IO.Log.warning('Too many latent variables specified. '
+                       'Will use {}'.format(min(n, m)))
+        return min(n, m)
+    return nr_lv
+
+
+def argmax_rule(Y, ties='all'):
+    """Return the dummy matrix assigning every row of Y to its maximum.
+
+       ties tells what to do with rows whose maximum is shared by more
+       classes: 'all' assigns all of them, 'first' only the first one and
+       'none' no class at all.
+    """
+    if ties not in ('all', 'first', 'none'):
+        raise ValueError('Unknown ties rule {}'.format(repr(ties)))
+    is_max = Y == np.max(Y, axis=1)[:, np.newaxis]
+    if ties == 'first':
+        dummy = np.zeros(Y.shape, dtype=int)
+        dummy[np.arange(Y.shape[0]), np.argmax(Y, axis=1)] = 1
+        return dummy
+    if ties == 'none':
+        is_max[np.sum(is_max, axis=1) > 1] = False
+    return is_max.astype(int)
+
+
+def threshold_rule(Y, threshold=0.5):
+    """Return the dummy matrix assigning every sample to the classes in
+       which Y reaches the threshold (a scalar or one per class).
+
+       Y must be un-scaled (Y * sigma_y + mean_y), so that 1 means member
+       and 0 non member; a sample may get no class or more than one.
+    """
+    return (Y >= threshold).astype(int)
+
+
+def bayesian_thresholds(Y_pred, Y_real):
+    """Return the per class thresholds for threshold_rule() which best
+       separate members and non members of every class.
+
+       The predictions Y_pred of the members (maximum of the column of the
+       dummy Y_real) and of the non members of every class are modeled as
+       normal distributions, the threshold is where their densities,
+       weighted by the class frequencies, are equal.
+    """
+    members = Y_real == np.max(Y_real, axis=0)
+    n_1 = np.sum(members, axis=0)
+    n_0 = Y_real.shape[0] - n_1
+    if np.any(n_1 < 2) or np.any(n_0 < 2):
+        raise ValueError('At least two members and two non members are '
+                         'needed in every class')
+    mean_1 = np.sum(Y_pred * members, axis=0) / n_1
+    mean_0 = np.sum(Y_pred * ~members, axis=0) / n_0
+    var_1 = np.sum(np.power(Y_pred - mean_1, 2) * members, axis=0) / n_1
+    var_0 = np.sum(np.power(Y_pred - mean_0, 2) * ~members, axis=0) / n_0
+
+    # log(n_1 * N(x; mean_1, var_1)) = log(n_0 * N(x; mean_0, var_0)) is
+    # a * x^2 + b * x + c = 0
+    a = 1 / (2 * var_0) - 1 / (2 * var_1)
+    b = mean_1 / var_1 - mean_0 / var_0
+    c = np.power(mean_0, 2) / (2 * var_0) - \
+        np.power(mean_1, 2) / (2 * var_1) + \
+        np.log(n_1 * np.sqrt(var_0) / (n_0 * np.sqrt(var_1)))
+    middle = (mean_0 + mean_1) / 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        delta = np.sqrt(np.maximum(np.power(b, 2) - 4 * a * c, 0))
+        roots = np.array([(-b - delta) / (2 * a), (-b + delta) / (2 * a)])
+        closest = roots[np.argmin(np.abs(roots - middle), axis=0),
+                        np.arange(len(a))]
+        linear = -c / b
+    return np.where(np.abs(a) > np.finfo(float).eps * np.abs(b), closest,
+                    linear)
+
+
+DIAGNOSTICS_CHUNK_SIZE = 4096  # rows processed at once by diagnostics
+
+
+def _row_chunks(X, chunk_size=None):
+    """Yield (index of the first row, dense rows) for every chunk of at most
+       chunk_size rows of X (BlockedMatrix X use their own blocks)."""
+    if isinstance(X, BlockedMatrix):
+        yield from X.blocks()
+        return
+    chunk_size = chunk_size or DIAGNOSTICS_CHUNK_SIZE
+    for start in range(0, X.shape[0], chunk_size):
+        stop = start + chunk_size
+        if isinstance(X, CenteredSparse):
+            rows = (X.X[start:stop].toarray() - X.mean) / X.sigma
+        elif scipy.sparse.issparse(X):
+            rows = X[start:stop].toarray()
+        else:
+            rows = np.asarray(X[start:stop])
+        yield start, rows
+
+
+def hotelling_t_square(T, eigenvalues, chunk_size=None):
+    """Return the Hotelling's T^2 of every row of the scores T.
+
+       T^2_i = sum_a T_ia^2 / eigenvalues_a, computed chunk by chunk in
+       O(n * a) time and O(chunk_size * a) memory.
+    """
+    t_square = np.empty(T.shape[0], dtype=T.dtype)
+    for start, rows in _row_chunks(T, chunk_size):
+        t_square[start:start + len(rows)] = np.sum(
+            np.power(rows, 2) / eigenvalues, axis=1)
+    return t_square
+
+
+def q_residuals(X, T, P, chunk_size=None):
+    """Return the Q statistic (sum of squared residuals) of every row of X.
+
+       The residuals X - T * P' are built a chunk of rows at a time, in
+       O(n * m) time and O(chunk_size * m) memory.
+    """
+    q = np.empty(X.shape[0], dtype=T.dtype)
+    for start, rows in _row_chunks(X, chunk_size):
+        stop = start + len(rows)
+        residuals = rows - np.dot(T[start:stop], P.T)
+        q[start:stop] = np.sum(np.power(residuals, 2), axis=1)
+    return q
+
+
+def leverage(U, chunk_size=None):
+    """Return the leverage u_i * inv(U' * U) * u_i' of every row of U,
+       chunk by chunk in O(n * a^2) time and O(chunk_size * a) memory."""
+    inv = np.linalg.inv(np.dot(U.T, U))
+    leverage = np.empty(U.shape[0], dtype=U.dtype)
+    for start, rows in _row_chunks(U, chunk_size):
+        leverage[start:start + len(rows)] = np.sum(
+            np.dot(rows, inv) * rows, axis=1)
+    return leverage
+
+
+def cross_validation(train_set, split, sample, max_lv, engine='nipals',
+                     n_jobs=1, plan=None):
+    """Perform a cross-validation procedure on a TrainingSet dataset.
+
+    Return a CVStatistics object with the statistics of every split and
+    number of latent variables up to max_lv.
+    The splits are those of the given SplitPlan or, if plan is None, the
+    venetian blind ones of split and sample (see venetian_blind_plan()).
+    Every split is fitted with the given engine (see ENGINES).
+    With n_jobs > 1 (or -1 for all the cpus) the splits are fitted by a
+    pool of spawned processes, which read x and y from shared memory; the
+    results are the same and in the same order. Python < 3.8 has no shared
+    memory, there the splits are always fitted in this process.
 
     Raise ValueError if any of the arguments is not within their bounds.
     """
-    if split <= 1 or split > train_set.n:
+    if plan is None:
+        plan = venetian_blind_plan(train_set.n, split, sample)
+    elif plan.n != train_set.n:
+        raise ValueError('The given plan splits {} samples instead of '
+                         '{}'.format(plan.n, train_set.n))
+    if max_lv < 1 or max_lv > min(train_set.n, train_set.m):
+        raise ValueError('The given max LV number ({}) '
+                         'is not valid.'.format(max_lv))
+
+    if n_jobs == -1:
+        n_jobs = os.cpu_count() or 1
+    if n_jobs < 1:
+        raise ValueError('The given number of jobs ({}) '
+                         'is not valid.'.format(n_jobs))
+    if n_jobs > 1 and not isinstance(train_set.x, np.ndarray):
+        IO.Log.warning('Only dense datasets are cross-validated in parallel')
+        n_jobs = 1
+    if n_jobs > 1:
+        try:
+            from multiprocessing import shared_memory
+        except ImportError:  # Python < 3.8
+            IO.Log.warning('Python {}.{} has no shared memory, the splits are '
+                           'cross-validated in a single '
+                           'process'.format(*sys.version_info[:2]))
+            n_jobs = 1
+
+    if n_jobs == 1:
+        return _cv_statistics(
+            _cross_validation_split(train, test, max_lv, engine)
+            for train, test in _gathered_splits(train_set.x, train_set.y,
+                                                plan))
+
+    blocks = list()
+    try:
+        arrays = list()
+        for array in (train_set.x, train_set.y):
+            block = shared_memory.SharedMemory(create=True,
+                                               size=max(array.nbytes, 1))
+            blocks.append(block)
+            np.ndarray(array.shape, array.dtype, buffer=block.buf)[:] = array
+            arrays.append((block.name, array.shape, array.dtype))
+
+        trains, tests = zip(*plan)
+        # spawn on every platform: forked workers would inherit the threads
+        # of the GUI, spawned ones import its entry script as __mp_main__
+        # (see pls-da.py)
+        context = multiprocessing.get_context('spawn')
+        with concurrent.futures.ProcessPoolExecutor(
+                n_jobs, mp_context=context) as executor:
+            return _cv_statistics(executor.map(
+                _cross_validation_worker, [arrays] * len(plan), trains, tests,
+                [max_lv] * len(plan), [engine] * len(plan)))
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+
+def leave_one_out(train_set, max_lv):
+    """Perform a leave-one-out cross-validation on a TrainingSet dataset.
+
+    Return the same CVStatistics of cross_validation() with split equal
+    to the number of samples and sample equal to 1, but
+    without refitting n models: the cross products X'X and X'Y of all the
+    samples are computed once and downdated by every left out sample, then
+    the covariance PLS kernel extracts the latent variables from them.
+    If a split has less than max_lv latent variables its predictions stay
+    those of the last one, as in cross_validation().
+
+    Raise ValueError if max_lv is not within its bounds.
+    """
+    if max_lv < 1 or max_lv > min(train_set.n, train_set.m):
+        raise ValueError('The given max LV number ({}) '
+                         'is not valid.'.format(max_lv))
+
+    X, Y = train_set.x, train_set.y
+    XtX, XtY = _gram(X), X.T.dot(Y)
+    y_ss = np.sum(np.power(Y, 2), axis=0)
+
+    splits = []
+    for start, rows in _row_chunks(X):
+        for i, x in enumerate(rows, start):
+            y = Y[i:i + 1]
+            W, P, Q, b, R, _ = _covariance_kernel(
+                XtX - np.outer(x, x), XtY - np.outer(x, y),
+                y_ss - np.power(y[0], 2), max_lv)
+            y_pred = np.cumsum(Q * (np.dot(x, R) * b), axis=1)
+            splits.append(_split_statistics(
+                y, _padded_predictions(y_pred[np.newaxis], max_lv)))
+    return _cv_statistics(splits)
+
+
+def _cross_validation_split(train, test, max_lv, engine):
+    """Fit train (x, y) and return the _split_statistics() on test (x, y)
+       of every number of latent variables up to max_lv.
+
+       Only max_lv latent variables are extracted: all of them are needed
+       in every split to build the curves of the statistics over the lv.
+       A split with less of them (e.g. the engine stopped on a rank
+       deficient train) keeps the predictions of its last one.
+    """
+    model = fit(*train, nr_lv=max_lv, engine=engine)
+    return _split_statistics(
+        test[1], _padded_predictions(model.predict_all(test[0]), max_lv))
+
+
+def _padded_predictions(y_pred_all, max_lv):
+    """Return the n x p x max_lv y_pred_all, whose missing latent variables
+       repeat the predictions of the last one."""
+    missing = max_lv - y_pred_all.shape[2]
+    if missing <= 0:
+        return y_pred_all
+    return np.concatenate(
+        (y_pred_all, np.repeat(y_pred_all[:, :, -1:], missing, axis=2)),
+        axis=2)
+
+
+def _cross_validation_worker(arrays, train, test, max_lv, engine):
+    """Run _cross_validation_split() on the split of x and y selected by
+       the train and test indices, x and y are (name, shape, dtype) of
+       shared memory blocks."""
+    from multiprocessing import shared_memory
+    blocks = [shared_memory.SharedMemory(name=name) for name, _, _ in arrays]
+    try:
+        x, y = (np.ndarray(shape, dtype, buffer=block.buf)
+                for block, (_, shape, dtype) in zip(blocks, arrays))
+        # np.take copies the split, so no view of the blocks is kept
+        train, test = ((np.take(x, train, axis=0), np.take(y, train, axis=0)),
+                       (np.take(x, test, axis=0), np.take(y, test, axis=0)))
+        del x, y
+        return _cross_validation_split(train, test, max_lv, engine)
+    finally:
+        for block in blocks:
+            block.close()
+
+
+class SplitPlan(object):
+    """Integer indices of the test samples of every cross-validation split.
+
+    The train samples of a split are all the others. A plan is built once
+    (see the *_plan() functions), it can be reused by many
+    cross-validations and saved in the workspace (see IO.dump()).
+    """
+
+    def __init__(self, n, tests):
+        """Save the test indices of every split of n samples.
+
+        Raise ValueError if a split has no test or no train sample or an
+        index out of [0, n).
+        """
+        self.n = n
+        self.tests = [np.unique(np.asarray(test, dtype=np.intp))
+                      for test in tests]
+        if not self.tests:
+            raise ValueError('A plan needs at least one split')
+        for test in self.tests:
+            if test.size == 0 or test.size >= n:
+                raise ValueError('Every split needs at least a test and a '
+                                 'train sample')
+            if test[0] < 0 or test[-1] >= n:
+                raise ValueError('Sample indices out of bounds '
+                                 '[0, {}]'.format(n - 1))
+
+    def __len__(self):
+        return len(self.tests)
+
+    def __iter__(self):
+        """Yield the (train, test) indices of every split."""
+        for k in range(len(self)):
+            yield self.train(k), self.tests[k]
+
+    def train(self, k):
+        """Return the indices of the train samples of split k."""
+        mask = np.ones(self.n, dtype=bool)
+        mask[self.tests[k]] = False
+        return np.flatnonzero(mask)
+
+
+def _folds_plan(folds, split):
+    """Return the SplitPlan testing split k on the samples of fold k."""
+    order = np.argsort(folds, kind='stable')
+    sizes = np.bincount(folds, minlength=split)
+    return SplitPlan(len(folds), np.split(order, np.cumsum(sizes)[:-1]))
+
+
+def venetian_blind_plan(n, split, sample):
+    """Return the venetian blind SplitPlan: blocks of sample consecutive
+       samples are tested by split 0, 1, ..., split - 1, 0, 1, ...
+
+       Raise ValueError if split or sample are not within their bounds.
+    """
+    if split <= 1 or split > n:
         raise ValueError('The given split number ({}) '
                          'is not valid.'.format(split))
-    if sample < 1 or sample > train_set.n:
+    if sample < 1 or sample > n:
         raise ValueError('The given sample number ({}) '
                          'is not valid.'.format(sample))
-    if max_lv < 1 or max_lv > min(train_set.n, train_set.m):
-        raise ValueError('The given max LV number ({}) '
-                         'is not valid.'.format(max_lv))
+    return _folds_plan(np.arange(n) // sample % split, split)
+
+
+def contiguous_plan(n, split):
+    """Return the SplitPlan testing split contiguous blocks of samples."""
+    if split <= 1 or split > n:
+        raise ValueError('The given split number ({}) '
+                         'is not valid.'.format(split))
+    return _folds_plan(np.arange(n) * split // n, split)
+
 
-    results = []
-    for train, test in venetian_blind_split(train_set, split, sample):
-        model = nipals(*train)
-        res = []
-        for lv in range(1, max_lv + 1):
-            model.nr_lv = lv
-            y_pred = model.predict(test[0])
-            res.append(Statistics(test[1], y_pred))
-        results.append(res)
-    return results
+def kfold_plan(n, split, seed=None):
+    """Return the SplitPlan testing split random folds of n / split
+       samples, seed makes the folds reproducible."""
+    if split <= 1 or split > n:
+        raise ValueError('The given split number ({}) '
+                         'is not valid.'.format(split))
+    random = np.random.RandomState(seed)
+    return _folds_plan(random.permutation(n) * split // n, split)
+
+
+def stratified_plan(categories, split, seed=None):
+    """Return the random SplitPlan of split folds in which every category
+       (e.g. train_set.categorical_y) is spread as evenly as possible."""
+    categories = np.asarray(categories)
+    n = len(categories)
+    if split <= 1 or split > n:
+        raise ValueError('The given split number ({}) '
+                         'is not valid.'.format(split))
+    random = np.random.RandomState(seed)
+    order = random.permutation(n)
+    order = order[np.argsort(categories[order], kind='stable')]
+    # deal the samples of every category in turn to the folds
+    folds = np.empty(n, dtype=np.intp)
+    folds[order] = np.arange(n) % split
+    return _folds_plan(folds, split)
+
+
+def monte_carlo_plan(n, split, test_size, seed=None):
+    """Return the SplitPlan of split independent random tests of
+       test_size samples each (a sample may be tested by many splits)."""
+    if split < 1:
+        raise ValueError('The given split number ({}) '
+                         'is not valid.'.format(split))
+    if test_size < 1 or test_size >= n:
+        raise ValueError('The given test size ({}) '
+                         'is not valid.'.format(test_size))
+    random = np.random.RandomState(seed)
+    return SplitPlan(n, [random.choice(n, test_size, replace=False)
+                         for _ in range(split)])
+
+
+def group_plan(groups, split):
+    """Return the SplitPlan in which the samples of a group (e.g. of a
+       batch) are always tested together.
+
+       The groups are assigned, largest first, to the smallest fold.
+    """
+    _, inverse, sizes = np.unique(groups, return_inverse=True,
+                                  return_counts=True)
+    if split <= 1 or split > len(sizes):
+        raise ValueError('The given split number ({}) is not valid for {} '
+                         'groups.'.format(split, len(sizes)))
+    group_folds = np.empty(len(sizes), dtype=np.intp)
+    fold_sizes = np.zeros(split, dtype=int)
+    for group in np.argsort(-sizes, kind='stable'):
+        group_folds[group] = np.argmin(fold_sizes)
+        fold_sizes[group_folds[group]] += sizes[group]
+    return _folds_plan(group_folds[inverse], split)
+
+
+def _take_rows(X, indices, out=None):
+    """Return the rows of X at indices, in out if X is an ndarray."""
+    if isinstance(X, np.ndarray):
+        return np.take(X, indices, axis=0, out=out)
+    if isinstance(X, CenteredSparse):
+        return CenteredSparse(X.X[indices], X.mean, X.sigma)
+    return X[indices]
+
+
+def _gathered_splits(x, y, plan):
+    """Yield ((train_x, train_y), (test_x, test_y)) of every split of plan.
+
+       Dense train_x, train_y and test_x are gathered into buffers
+       allocated once for the largest split, so they are overwritten by
+       the next split; test_y is always a new array.
+    """
+    sizes = [len(test) for test in plan.tests]
+    buffers = [None] * 3
+    if isinstance(x, np.ndarray):
+        buffers = [np.empty((plan.n - min(sizes), ) + x.shape[1:], x.dtype),
+                   np.empty((plan.n - min(sizes), ) + y.shape[1:], y.dtype),
+                   np.empty((max(sizes), ) + x.shape[1:], x.dtype)]
+    for train, test in plan:
+        out = [None if buffer is None else buffer[:len(indices)]
+               for buffer, indices in zip(buffers, (train, train, test))]
+        yield ((_take_rows(x, train, out[0]), _take_rows(y, train, out[1])),
+               (_take_rows(x, test, out[2]), _take_rows(y, test)))
 
 
 def venetian_blind_split(train_set, split, sample):
     """Split the dataset in train and test using the venetian blind algo."""
-
-    # find the minimum divisor of split * sample greater than n
-    # this is needed to be able to use the function np.roll properly
-    n = train_set.n
-    base = split * sample
-    div = n - (n % base) + (base if n % base else 0)
-
-    # build the set of mask used to create the first split
-    masks = []
-    masks.append(np.arange(0, div) % (split*sample) == 0)
-    for offset in range(1, sample):
-        masks.append(np.roll(masks[0], offset))
-
-    # build the mask for the first split
-    m = []
-    for i in zip(*masks):
-        x = False
-        for e in i:
-            x = x or e
-        m.append(x)
-
-    for offset in range(split):
-        # Create the mask for the current split and truncate it to
-        # its real length
-        mask = np.roll(m, offset * sample)[:n]
-        test_x = train_set.x[mask]
-        train_x = train_set.x[~mask]
-        test_y = train_set.y[mask]
-        train_y = train_set.y[~mask]
-
-        yield ((train_x, train_y), (test_x, test_y))
+    x, y = train_set.x, train_set.y
+    for train, test in venetian_blind_plan(train_set.n, split, sample):
+        yield ((_take_rows(x, train), _take_rows(y, train)),
+               (_take_rows(x, test), _take_rows(y, test)))
 
 
 def integer_bounds(P, T, col):
@@ -25,7 +25,6 @@ __license__ = "GPL3"
 
 
 import collections
-import copy
 import functools
 import math
 import numpy as np
@@ -154,10 +153,9 @@ def scree(ax, x=False, y=False):
     if bool(x) == bool(y):
         raise ValueError('In plot.scree() X, Y matrix flags must differ')
 
-    mdl = copy.deepcopy(MODEL)
-    mdl.nr_lv = mdl.max_lv
-
-    eigen = mdl.x_eigenvalues if x else mdl.y_eigenvalues
+    # all the max_lv eigenvalues, whatever MODEL.nr_lv is
+    eigen = MODEL._x_eigenvalues if x else MODEL._y_eigenvalues
+    eigen = eigen[:MODEL.max_lv]
     line_wrapper(ax, range(1, len(eigen) + 1), eigen)
 
     ax.set_title('Scree plot for {}'.format('X' if x else 'Y'))
@@ -178,13 +176,10 @@ def cumulative_explained_variance(ax, x=False, y=False):
         raise ValueError('In plot.cumulative_explained_variance() X, Y matrix '
                          'flags must differ')
 
-    mdl = copy.deepcopy(MODEL)
-    mdl.nr_lv = mdl.max_lv
-
-    if x:
-        cumulative_expl_var = mdl.cumulative_explained_variance_x
-    else:
-        cumulative_expl_var = mdl.cumulative_explained_variance_y
+    # all the max_lv eigenvalues, whatever MODEL.nr_lv is
+    eigen = MODEL._x_eigenvalues if x else MODEL._y_eigenvalues
+    eigen = eigen[:MODEL.max_lv]
+    cumulative_expl_var = np.cumsum(100 * eigen / np.sum(eigen))
 
     line_wrapper(ax, range(1, len(cumulative_expl_var) + 1),
                  cumulative_expl_var)
@@ -679,18 +674,11 @@ def data(ax):
 
 def rmsec_lv(ax):
     """Plot the RMSEC value over the lvs."""
-    mdl = copy.deepcopy(MODEL)
+    rmsec = model.LVStatistics(y_real=MODEL.Y,
+                               y_pred_all=MODEL.predict_all(MODEL.X)).rmsec
 
-    rmsec = []
-    for i in range(1, mdl.max_lv + 1):
-        mdl.nr_lv = i
-        pred = model.Statistics(y_real=mdl.Y, y_pred=mdl.Y_modeled)
-        rmsec.append(pred.rmsec)
-
-    rmsec = np.asarray(rmsec)
-
-    for index_y, y in enumerate(rmsec.T):
-        line_wrapper(ax, range(1, mdl.max_lv + 1), y,
+    for index_y, y in enumerate(rmsec):
+        line_wrapper(ax, range(1, MODEL.max_lv + 1), y,
                      cat=TRAIN_SET.categories[index_y],
                      label=TRAIN_SET.categories[index_y])
 
@@ -701,26 +689,15 @@ def rmsec_lv(ax):
 
 
 def rmsecv_lv(ax, stats):
-    """Plot the RMSECV value for the current cv."""
+    """Plot the RMSECV value for the current cv (a model.CVStatistics)."""
     if stats is None:
         IO.Log.debug('In plot.rmsecv_lv() stats is None')
         raise TypeError('Please run cross-validation')
 
-    r = []
-    for j in range(len(stats[0])):  # lv
-        rss = np.zeros((stats[0][j].p))
-        for i in range(len(stats)):  # split
-            for k, y in enumerate(stats[i][j].rss):  # y
-                rss[k] += y
-        r.append(rss)
-
-    r = np.asarray(r)
-    r = np.sqrt(r.T / MODEL.n)
-
-    for i in range(len(r)):
-        line_wrapper(ax, range(1, len(r.T) + 1), r[i],
-                     cat=TRAIN_SET.categories[i],
-                     label=TRAIN_SET.categories[i])
+    for index_y, y in enumerate(stats.rmsecv):
+        line_wrapper(ax, range(1, stats.max_lv + 1), y,
+                     cat=TRAIN_SET.categories[index_y],
+                     label=TRAIN_SET.categories[index_y])
 
     ax.set_title('RMSECV')
     ax.set_xlabel('Latent variables')
@@ -730,19 +707,11 @@ def rmsecv_lv(ax, stats):
 
 def rmsep_lv(ax):
     """Plot the RMSEC value over the lvs."""
-    mdl = copy.deepcopy(MODEL)
-
-    rmsep = []
-    for i in range(1, mdl.max_lv + 1):
-        mdl.nr_lv = i
-        y_pred = mdl.predict(TEST_SET.x)
-        pred = model.Statistics(y_real=TEST_SET.y, y_pred=y_pred)
-        rmsep.append(pred.rmsec)
-
-    rmsep = np.asarray(rmsep)
+    rmsep = model.LVStatistics(
+        y_real=TEST_SET.y, y_pred_all=MODEL.predict_all(TEST_SET.x)).rmsec
 
-    for index_y, y in enumerate(rmsep.T):
-        line_wrapper(ax, range(1, mdl.max_lv + 1), y,
+    for index_y, y in enumerate(rmsep):
+        line_wrapper(ax, range(1, MODEL.max_lv + 1), y,
                      cat=TRAIN_SET.categories[index_y],
                      label=TRAIN_SET.categories[index_y])
 
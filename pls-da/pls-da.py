@@ -24,51 +24,57 @@ __copyright__ = "PLS-DA  Copyright (C)  2017"
 __license__ = "GPL3"
 
 
-if __name__ != '__main__':
-    raise SystemExit('Please do not load that script, run it!')
+def main():
+    """Check the dependencies, then create and run the user interface."""
+    for lib in ('matplotlib', 'numpy', 'PyQt5', 'scipy', 'yaml'):
+        try:
+            exec('import ' + str(lib))
+        except ImportError:
+            raise SystemExit('Could not import {} library, '.format(lib) +
+                             'please install it!')
 
-for lib in ('matplotlib', 'numpy', 'PyQt5', 'scipy', 'yaml'):
-    try:
-        exec('import ' + str(lib))
-    except ImportError:
-        raise SystemExit('Could not import {} library, '.format(lib) +
-                         'please install it!')
+    from PyQt5.QtCore import QCoreApplication, QTimer
+    from PyQt5.QtWidgets import QApplication
+    import signal
+    import sys
 
+    import gui
+    import utility
 
-from PyQt5.QtCore import QCoreApplication, QTimer
-from PyQt5.QtWidgets import QApplication
-import signal
-import sys
+    # check python version
+    if sys.version_info < (3,):
+        major, minor, *__ = sys.version_info
+        raise SystemExit('WARNING: You are using the Python interpreter '
+                         '{}.{}.\nPlease use at least Python version '
+                         '3!'.format(major, minor))
 
-import gui
-import utility
+    # Create graphical environment
+    application = QApplication(sys.argv)
+    user_interface = gui.UserInterface('PLS-DA')
 
-# check python version
-if sys.version_info < (3,):
-    major, minor, *__ = sys.version_info
-    raise SystemExit('WARNING: You are using the Python interpreter {}.{}.\n'
-                     'Please use at least Python version 3!'.format(major,
-                                                                    minor))
+    # catch Ctrl+C or INTERRUPT signal
+    signal.signal(signal.SIGINT, user_interface.quit)  # asks confirmation
 
-# Create graphical environment
-application = QApplication(sys.argv)
-user_interface = gui.UserInterface('PLS-DA')
+    # catch TERMINATION signal
+    signal.signal(signal.SIGTERM,
+                  lambda *args: QCoreApplication.quit())  # quit immediately
 
-# catch Ctrl+C or INTERRUPT signal
-signal.signal(signal.SIGINT, user_interface.quit)  # asks confirmation
+    # Create a timer to let the python interpreter run ...
+    timer = QTimer()
+    timer.start(500)  # ... every 500 milliseconds ...
+    timer.timeout.connect(lambda: None)  # ... and just do nothing
 
-# catch TERMINATION signal
-signal.signal(signal.SIGTERM,
-              lambda *args: QCoreApplication.quit())  # quit immediately
+    if utility.CLI.args().verbose:
+        user_interface.MainWindow.dumpObjectTree()
 
-# Create a timer to let the python interpreter run ...
-timer = QTimer()
-timer.start(500)  # ... every 500 milliseconds ...
-timer.timeout.connect(lambda: None)  # ... and just do nothing
+    # Start Qt event loop
+    user_interface.show()
+    sys.exit(application.exec_())
 
-if utility.CLI.args().verbose:
-    user_interface.MainWindow.dumpObjectTree()
 
-# Start Qt event loop
-user_interface.show()
-sys.exit(application.exec_())
+if __name__ == '__main__':
+    main()
+elif __name__ != '__mp_main__':
+    # __mp_main__ is this script imported by the processes spawned by
+    # multiprocessing (see model.cross_validation()), which need only model
+    raise SystemExit('Please do not load that script, run it!')
@@ -4,9 +4,13 @@
 import copy
 import math
 import numpy as np
+import os
 import scipy
 import sklearn.cross_decomposition as sklCD
+import sys
+import tempfile
 import unittest
+import unittest.mock as mock
 
 from context import IO
 from context import model
@@ -99,6 +103,128 @@ class test_trainingset_preprocessing(unittest.TestCase):
         np.testing.assert_allclose(self.train_set.x, dataset_autoscaled)
         np.testing.assert_allclose(self.train_set.y, dummy_y_autoscaled)
 
+    def test_TrainingSet_float32(self):
+        train_set = model.TrainingSet('.train_set_synthesis.csv',
+                                      dtype=np.float32)
+        train_set.autoscale()
+        test_set = model.TestSet('.test_set_synthesis.csv', train_set)
+        self.assertEqual(train_set.x.dtype, np.float32)
+        self.assertEqual(train_set.y.dtype, np.float32)
+        self.assertEqual(test_set.dtype, np.float32)
+        self.assertEqual(test_set.x.dtype, np.float32)
+
+    def test_TrainingSet_sparse(self):
+        train_set = model.TrainingSet('.train_set_synthesis.csv',
+                                      sparse=True)
+        train_set.autoscale()
+        test_set = model.TestSet('.test_set_synthesis.csv', train_set)
+        self.train_set.autoscale()
+        dense_test_set = model.TestSet('.test_set_synthesis.csv',
+                                       self.train_set)
+        self.assertTrue(train_set.sparse and test_set.sparse)
+        np.testing.assert_allclose(train_set.x.toarray(), self.train_set.x,
+                                   atol=1e-10)
+        np.testing.assert_allclose(test_set.x.toarray(), dense_test_set.x,
+                                   atol=1e-10)
+
+    def test_TrainingSet_update(self):
+        old = np.arange(self.train_set.n) % 4 != 3
+        new = np.logical_not(old)
+        train_set = model.TrainingSet('.train_set_synthesis.csv')
+        train_set.x, train_set.y = train_set.x[old], train_set.y[old]
+        train_set.categorical_y = list(
+            np.array(self.train_set.categorical_y)[old])
+        train_set.body = [row for row, k in zip(self.train_set.body, old)
+                          if k]
+        train_set.autoscale()
+        autoscaled = model.TrainingSet('.train_set_synthesis.csv')
+        autoscaled.autoscale()
+
+        x, y = train_set.update(self.train_set.x[new],
+                                np.array(self.train_set.categorical_y)[new])
+        order = np.concatenate((np.flatnonzero(old), np.flatnonzero(new)))
+        self.assertEqual(train_set.n, self.train_set.n)
+        self.assertEqual(len(train_set.body), self.train_set.n)
+        self.assertEqual(train_set.categorical_y,
+                         [self.train_set.categorical_y[i] for i in order])
+        np.testing.assert_allclose(train_set.mean_x, autoscaled.mean_x)
+        np.testing.assert_allclose(train_set.sigma_x, autoscaled.sigma_x)
+        np.testing.assert_allclose(train_set.x, autoscaled.x[order])
+        np.testing.assert_allclose(train_set.y, autoscaled.y[order])
+        np.testing.assert_allclose(x, autoscaled.x[new])
+        np.testing.assert_allclose(y, autoscaled.y[new])
+        self.assertRaises(ValueError, train_set.update,
+                          self.train_set.x[:1], ['?'])
+
+        # the samples added are removed as any other one
+        train_set.remove(np.arange(np.sum(old), self.train_set.n))
+        np.testing.assert_allclose(train_set.x * train_set.sigma_x +
+                                   train_set.mean_x, self.train_set.x[old])
+        self.assertEqual(len(train_set.body), train_set.n)
+
+    def test_TrainingSet_remove(self):
+        removed = [2, 7, 11]
+        keep = np.setdiff1d(np.arange(self.train_set.n), removed)
+        expected = model.TrainingSet('.train_set_synthesis.csv')
+        expected.x, expected.y = expected.x[keep], expected.y[keep]
+        expected.categorical_y = [expected.categorical_y[i] for i in keep]
+        expected.autoscale()
+
+        self.train_set.autoscale()
+        self.train_set.remove(removed)
+        # the remaining samples are rescaled only when read
+        self.assertIsInstance(self.train_set._x, model._LazyRows)
+        self.assertEqual(self.train_set.n, len(keep))
+        self.assertEqual(len(self.train_set.body), len(keep))
+        self.assertEqual(self.train_set.categorical_y,
+                         expected.categorical_y)
+        np.testing.assert_allclose(self.train_set.mean_x, expected.mean_x)
+        np.testing.assert_allclose(self.train_set.x, expected.x,
+                                   atol=1e-10)
+        np.testing.assert_allclose(self.train_set.y, expected.y,
+                                   atol=1e-10)
+        self.assertRaises(ValueError, self.train_set.remove, [len(keep)])
+
+    def test_TrainingSet_update_remove(self):
+        raw = model.TrainingSet('.train_set_synthesis.csv')
+        x, categories = raw.x, list(raw.categorical_y)
+        self.train_set.autoscale()
+        self.train_set.update(x[:6] + 1, categories[:6])
+        self.train_set.remove([0, 3, raw.n + 1])
+        self.train_set.update(x[6:9] - 1, categories[6:9])
+        # rows of the file, of both batches and after deleted ones
+        self.train_set.remove([2, raw.n - 1, raw.n + 2, raw.n + 5])
+
+        rows = np.vstack((x, x[:6] + 1, x[6:9] - 1))
+        keep = np.delete(np.arange(len(rows)),
+                         [0, 3, raw.n + 1, 4, raw.n + 2, raw.n + 5,
+                          raw.n + 8])
+        expected = model.TrainingSet('.train_set_synthesis.csv')
+        expected.x = rows[keep]
+        labels = categories + categories[:6] + categories[6:9]
+        expected.categorical_y = [labels[i] for i in keep]
+        expected.y = np.array([[float(c == k) for k in expected.categories]
+                               for c in expected.categorical_y])
+        expected.autoscale()
+
+        self.assertEqual(self.train_set.categorical_y,
+                         expected.categorical_y)
+        np.testing.assert_allclose(
+            [row[1:] for row in self.train_set.body], rows[keep])
+        np.testing.assert_allclose(self.train_set.x, expected.x, atol=1e-10)
+        np.testing.assert_allclose(self.train_set.y, expected.y, atol=1e-10)
+
+    def test_TestSet_rescale(self):
+        self.train_set.autoscale()
+        test_set = model.TestSet('.test_set_synthesis.csv', self.train_set)
+        self.train_set.remove([1, 4])
+        test_set.rescale(self.train_set)
+        expected = model.TestSet('.test_set_synthesis.csv', self.train_set)
+        np.testing.assert_allclose(test_set.x, expected.x, atol=1e-10)
+        np.testing.assert_allclose(test_set.y, expected.y, atol=1e-10)
+        np.testing.assert_array_equal(test_set.mean_x,
+                                      self.train_set.mean_x)
+
 
 class test_eigen_module(unittest.TestCase):
 
@@ -317,6 +443,644 @@ class test_nipals_method(nipals_abstract, unittest.TestCase):
                                    atol=absolute_tolerance)
 
 
+class test_engines(unittest.TestCase):
+
+    def setUp(self):
+        self.train_set = model.TrainingSet('.train_set_synthesis.csv')
+        self.train_set.autoscale()
+        self.nipals = model.nipals(self.train_set.x, self.train_set.y)
+
+    def tearDown(self):
+        self.train_set = None
+        self.nipals = None
+
+    def test_fit_unknown_engine(self):
+        self.assertRaises(ValueError, model.fit, self.train_set.x,
+                          self.train_set.y, engine='unknown')
+
+    def test_simpls_single_y_equals_nipals(self):
+        y = self.train_set.y[:, :1]
+        nipals = model.nipals(self.train_set.x, y)
+        simpls = model.fit(self.train_set.x, y, engine='simpls')
+        self.assertEqual(simpls.engine, 'simpls')
+        for lv in range(1, nipals.max_lv + 1):
+            with self.subTest(lv=lv):
+                nipals.nr_lv = simpls.nr_lv = lv
+                np.testing.assert_allclose(simpls.B, nipals.B, atol=1e-8)
+
+    def test_kernel_pls_equals_nipals(self):
+        random_state = np.random.RandomState(0)
+        X = random_state.randn(10, 40)
+        Y = random_state.randn(10, 3)
+        nipals = model.nipals(X, Y, tol=1e-14)
+        kernel = model.fit(X, Y, engine='kernel')
+        self.assertEqual(kernel.max_lv, nipals.max_lv)
+        for attr in ('T', 'P', 'W', 'U', 'Q', 'b', 'B'):
+            with self.subTest(attr=attr):
+                np.testing.assert_allclose(getattr(kernel, attr),
+                                           getattr(nipals, attr), atol=1e-5)
+
+    def test_rank_deficient_wide_x(self):
+        random_state = np.random.RandomState(0)
+        X = random_state.randn(30, 500)
+        X -= X.mean(axis=0)  # centering leaves rank 29
+        Y = np.eye(3)[np.arange(30) % 3]
+        Y -= Y.mean(axis=0)
+        for engine in ('covariance', 'kernel', 'simpls'):
+            with self.subTest(engine=engine):
+                mdl = model.fit(X, Y, engine=engine)
+                self.assertEqual(mdl.max_lv, 29)
+                self.assertEqual(mdl.stop_reason, 'rank')
+
+    def test_null_cross_product(self):
+        # a single category is null once centered
+        Y = np.zeros_like(self.train_set.y)
+        for engine in sorted(model.ENGINES):
+            with self.subTest(engine=engine):
+                self.assertRaises(ValueError, model.fit, self.train_set.x,
+                                  Y, engine=engine)
+        self.assertRaises(ValueError, model.nipals, self.train_set.x, Y,
+                          closed_form=True)
+
+    def test_simpls_gram_only_for_tall_x(self):
+        tall = model.simpls(self.train_set.x, self.train_set.y, 2)
+        XtX = tall._XtX
+        np.testing.assert_allclose(XtX, np.dot(self.train_set.x.T,
+                                               self.train_set.x))
+        tall.extend(2)
+        self.assertIs(tall._XtX, XtX)
+
+        random_state = np.random.RandomState(0)
+        X = random_state.randn(12, 40)
+        X -= X.mean(axis=0)
+        Y = np.eye(3)[np.arange(12) % 3]
+        Y -= Y.mean(axis=0)
+        full = model.simpls(X, Y)
+        wide = model.simpls(X, Y, 2)
+        wide.extend(3)
+        self.assertIsNone(wide._XtX)
+        full.nr_lv = 5
+        for attr in ('T', 'P', 'W', 'U', 'B', 'x_eigenvalues'):
+            with self.subTest(attr=attr):
+                np.testing.assert_allclose(getattr(wide, attr),
+                                           getattr(full, attr), atol=1e-10)
+
+    def test_covariance_pls_equals_nipals(self):
+        X = self.train_set.x
+        Y = self.train_set.y + np.random.RandomState(0).randn(20, 4) / 10
+        nipals = model.nipals(X, Y, tol=1e-14)
+        covariance = model.fit(X, Y, engine='covariance')
+        self.assertEqual(covariance.max_lv, nipals.max_lv)
+        for attr in ('T', 'P', 'W', 'U', 'Q', 'b', 'B', 'x_eigenvalues',
+                     'y_eigenvalues'):
+            with self.subTest(attr=attr):
+                np.testing.assert_allclose(getattr(covariance, attr),
+                                           getattr(nipals, attr), atol=1e-5)
+
+    def test_nipals_closed_form(self):
+        nipals = model.nipals(self.train_set.x, self.train_set.y, tol=1e-14)
+        closed = model.nipals(self.train_set.x, self.train_set.y,
+                              closed_form=True)
+        self.assertTrue(np.all(nipals.iterations > 0))
+        self.assertTrue(np.all(closed.iterations == 0))
+        for attr in ('T', 'P', 'W', 'U', 'Q', 'b', 'B'):
+            with self.subTest(attr=attr):
+                np.testing.assert_allclose(getattr(closed, attr),
+                                           getattr(nipals, attr), atol=1e-5)
+
+    def test_extend(self):
+        for engine in sorted(model.ENGINES):
+            with self.subTest(engine=engine):
+                kwargs = {'tol': 1e-14} if engine == 'nipals' else {}
+                full = model.fit(self.train_set.x, self.train_set.y,
+                                 engine=engine, **kwargs)
+                mdl = model.fit(self.train_set.x, self.train_set.y, nr_lv=2,
+                                engine=engine)
+                T = mdl.T.copy()
+                self.assertEqual(mdl.extend(3), 3)
+                self.assertEqual(mdl.extend(5), full.max_lv - 5)
+                self.assertEqual(mdl.nr_lv, full.max_lv)
+                np.testing.assert_array_equal(mdl.T[:, :2], T)
+                np.testing.assert_allclose(mdl.B, full.B, atol=1e-6)
+
+    def test_nipals_without_deflation(self):
+        X, Y = self.train_set.x, self.train_set.y
+        X_copy = X.copy()
+        implicit = model.nipals(X, Y, deflate=False)
+        np.testing.assert_array_equal(X, X_copy)
+        np.testing.assert_array_equal(implicit.iterations,
+                                      self.nipals.iterations)
+        for attr in ('T', 'P', 'W', 'U', 'Q', 'b', 'B'):
+            with self.subTest(attr=attr):
+                np.testing.assert_allclose(getattr(implicit, attr),
+                                           getattr(self.nipals, attr),
+                                           atol=1e-10)
+
+    def test_float32(self):
+        train_set = model.TrainingSet('.train_set_synthesis.csv',
+                                      dtype=np.float32)
+        train_set.autoscale()
+        test_set = model.TestSet('.test_set_synthesis.csv', train_set)
+        for engine in sorted(model.ENGINES):
+            with self.subTest(engine=engine):
+                mdl = model.fit(train_set.x, train_set.y, engine=engine)
+                self.assertEqual(mdl.T.dtype, np.float32)
+                self.assertEqual(mdl.B.dtype, np.float32)
+                self.assertEqual(mdl.predict(test_set.x).dtype, np.float32)
+
+                report = model.precision_report(self.train_set.x,
+                                                self.train_set.y,
+                                                engine=engine)
+                self.assertLess(np.max(report['B']), 1e-3)
+                np.testing.assert_array_equal(report['classification'], 1)
+
+    def test_stopping_criteria(self):
+        X, Y = self.train_set.x, self.train_set.y
+        x_ss, y_ss = np.sum(np.power(X, 2)), np.sum(np.power(Y, 2))
+        for engine in sorted(model.ENGINES):
+            with self.subTest(engine=engine):
+                criteria = model.StoppingCriteria(explained_x=90)
+                mdl = model.fit(X, Y, engine=engine, criteria=criteria)
+                self.assertEqual(mdl.stop_reason, 'explained_x')
+                self.assertLess(mdl.max_lv, self.nipals.max_lv)
+                self.assertGreaterEqual(
+                    100 * (1 - np.sum(np.power(mdl.E_x, 2)) / x_ss), 90)
+                mdl.nr_lv = mdl.max_lv - 1
+                self.assertLess(
+                    100 * (1 - np.sum(np.power(mdl.E_x, 2)) / x_ss), 90)
+
+                criteria = model.StoppingCriteria(explained_y=60)
+                mdl = model.fit(X, Y, engine=engine, criteria=criteria)
+                self.assertEqual(mdl.stop_reason, 'explained_y')
+                self.assertGreaterEqual(
+                    100 * (1 - np.sum(np.power(mdl.E_y, 2)) / y_ss), 60)
+
+                criteria = model.StoppingCriteria(min_residual=2.0)
+                mdl = model.fit(X, Y, engine=engine, criteria=criteria)
+                self.assertEqual(mdl.stop_reason, 'min_residual')
+                self.assertLessEqual(np.linalg.norm(mdl.E_x), 2.0)
+
+                criteria = model.StoppingCriteria(time_budget=0)
+                mdl = model.fit(X, Y, engine=engine, criteria=criteria)
+                self.assertEqual(mdl.stop_reason, 'time_budget')
+                self.assertEqual(mdl.max_lv, 1)
+
+        self.assertEqual(self.nipals.stop_reason, 'max_lv')
+
+    def test_simpls_full_rank_coefficient(self):
+        simpls = model.simpls(self.train_set.x, self.train_set.y)
+        np.testing.assert_allclose(simpls.B, self.nipals.B, atol=1e-6)
+        np.testing.assert_allclose(self.train_set.x,
+                                   np.dot(simpls.T, simpls.P.T), atol=1e-8)
+
+    def test_sparse(self):
+        train_set = model.TrainingSet('.train_set_synthesis.csv',
+                                      sparse=True)
+        train_set.autoscale()
+        test_set = model.TestSet('.test_set_synthesis.csv', train_set)
+        dense_test_set = model.TestSet('.test_set_synthesis.csv',
+                                       self.train_set)
+        for engine in sorted(model.ENGINES):
+            with self.subTest(engine=engine):
+                kwargs = {'tol': 1e-14} if engine == 'nipals' else {}
+                sparse = model.fit(train_set.x, train_set.y, engine=engine,
+                                   **kwargs)
+                dense = model.fit(self.train_set.x, self.train_set.y,
+                                  engine=engine, **kwargs)
+                for attr in ('T', 'P', 'W', 'B', 'E_x'):
+                    np.testing.assert_allclose(getattr(sparse, attr),
+                                               getattr(dense, attr),
+                                               atol=1e-6)
+                np.testing.assert_allclose(sparse.predict(test_set.x),
+                                           dense.predict(dense_test_set.x),
+                                           atol=1e-6)
+
+    def test_out_of_core_nipals(self):
+        x = model.TrainingSet('.train_set_synthesis.csv').x
+        with tempfile.TemporaryDirectory() as directory:
+            memmap = np.memmap(os.path.join(directory, 'x.dat'),
+                               dtype=x.dtype, mode='w+', shape=x.shape)
+            memmap[:] = x
+            blocked = model.BlockedMatrix(memmap, block_size=3)
+            mean, sigma = blocked.statistics()
+            np.testing.assert_allclose(mean, self.train_set.mean_x)
+            np.testing.assert_allclose(sigma, self.train_set.sigma_x)
+
+            def chunks():
+                return (x[i:i + 7] for i in range(0, len(x), 7))
+
+            for source in (memmap, chunks):
+                mdl = model.out_of_core_nipals(source, self.train_set.y,
+                                               block_size=3, mean=mean,
+                                               sigma=sigma)
+                self.assertIsInstance(mdl.X, model.BlockedMatrix)
+                np.testing.assert_array_equal(mdl.iterations,
+                                              self.nipals.iterations)
+                for attr in ('T', 'P', 'W', 'B', 'Y_modeled'):
+                    np.testing.assert_allclose(getattr(mdl, attr),
+                                               getattr(self.nipals, attr),
+                                               atol=1e-8)
+
+    def test_online_update(self):
+        raw = model.TrainingSet('.train_set_synthesis.csv')
+        old, new = np.arange(raw.n) % 4 != 3, np.arange(raw.n) % 4 == 3
+        train_set = model.TrainingSet('.train_set_synthesis.csv')
+        train_set.x, train_set.y = train_set.x[old], train_set.y[old]
+        train_set.categorical_y = list(np.array(raw.categorical_y)[old])
+        train_set.body = [row for row, k in zip(raw.body, old) if k]
+        train_set.autoscale()
+        mdl = model.nipals(train_set.x, train_set.y)
+
+        train_set.update(raw.x[new], np.array(raw.categorical_y)[new])
+        mdl.update(train_set)
+        # neither the training set nor the scores are built by update()
+        self.assertIsInstance(train_set._x, model._LazyRows)
+        self.assertIsInstance(mdl._X, model._LazyRows)
+        self.assertIn('_score_weights', vars(mdl))
+
+        full = model.covariance_pls(train_set.x, train_set.y)
+        self.assertEqual(mdl.n, raw.n)
+        # the classes are balanced, so the sign of a latent variable is
+        # chosen between columns of Y of the same variance
+        signs = np.sign(np.sum(mdl.W * full.W, axis=0))
+        for attr in ('T', 'U', 'W', 'P', 'Q'):
+            with self.subTest(attr=attr):
+                np.testing.assert_allclose(getattr(mdl, attr) * signs,
+                                           getattr(full, attr), atol=1e-10)
+        for attr in ('b', 'B', 'x_eigenvalues', 'y_eigenvalues'):
+            with self.subTest(attr=attr):
+                np.testing.assert_allclose(getattr(mdl, attr),
+                                           getattr(full, attr), atol=1e-10)
+
+        # the samples added are removed as any other one
+        mdl.remove(train_set, np.arange(np.sum(old), raw.n))
+        self.assertEqual(mdl.n, np.sum(old))
+
+    def test_remove_samples(self):
+        removed = [2, 7, 11]
+        train_set = model.TrainingSet('.train_set_synthesis.csv')
+        keep = np.setdiff1d(np.arange(train_set.n), removed)
+        train_set.x, train_set.y = train_set.x[keep], train_set.y[keep]
+        train_set.categorical_y = [train_set.categorical_y[i] for i in keep]
+        train_set.autoscale()
+        full = model.nipals(train_set.x, train_set.y, tol=1e-14)
+
+        self.nipals.remove(self.train_set, removed)
+        self.assertEqual(self.nipals.n, len(keep))
+        for attr in ('T', 'P', 'W', 'Q', 'b', 'B', 'x_eigenvalues'):
+            with self.subTest(attr=attr):
+                np.testing.assert_allclose(getattr(self.nipals, attr),
+                                           getattr(full, attr), atol=1e-6)
+
+    def test_remove_samples_atomic(self):
+        x, B = self.train_set.x, self.nipals.B
+        body = list(self.train_set.body)
+        categorical_y = list(self.train_set.categorical_y)
+        moments = self.train_set.cross_products()
+        failures = (([1, self.train_set.n], None),
+                    ([1, 4, 9], ValueError('refit failed')))
+        for indices, error in failures:
+            with self.subTest(indices=indices), \
+                    mock.patch.object(model.Model, 'update',
+                                      side_effect=error):
+                self.assertRaises(ValueError, self.nipals.remove,
+                                  self.train_set, indices)
+                self.assertIs(self.train_set.x, x)
+                self.assertEqual(self.train_set.body, body)
+                self.assertEqual(self.train_set.categorical_y,
+                                 categorical_y)
+                for old, new in zip(moments,
+                                    self.train_set.cross_products()):
+                    np.testing.assert_array_equal(old, new)
+                self.assertIs(self.nipals.B, B)
+
+    def test_remove_samples_keeps_engine(self):
+        for engine in sorted(model.ENGINES):
+            with self.subTest(engine=engine):
+                train_set = model.TrainingSet('.train_set_synthesis.csv')
+                train_set.autoscale()
+                mdl = model.fit(train_set.x, train_set.y, engine=engine)
+                mdl.remove(train_set, [0, 5])
+                self.assertEqual(mdl.engine, engine)
+                full = model.fit(train_set.x, train_set.y, engine=engine,
+                                 **({'tol': 1e-14} if engine == 'nipals'
+                                    else {}))
+                for lv in range(1, full.max_lv + 1):
+                    mdl.nr_lv = full.nr_lv = lv
+                    np.testing.assert_allclose(mdl.B, full.B, atol=1e-6)
+                # the lazy scores and the eigenvalues of every engine
+                np.testing.assert_allclose(np.dot(mdl.T * mdl.b, mdl.Q.T),
+                                           np.dot(full.T * full.b, full.Q.T),
+                                           atol=1e-6)
+                np.testing.assert_allclose(mdl.x_eigenvalues,
+                                           full.x_eigenvalues, atol=1e-6)
+                np.testing.assert_allclose(mdl.y_eigenvalues,
+                                           full.y_eigenvalues, atol=1e-6)
+
+    def test_nipals_warm_start(self):
+        X = self.train_set.x
+        X = X + np.random.RandomState(0).randn(*X.shape) / 100
+        cold = model.nipals(X, self.train_set.y, tol=1e-14)
+        warm = model.nipals(X, self.train_set.y, tol=1e-14,
+                            warm_start=self.nipals)
+        self.assertLess(np.sum(warm.iterations), np.sum(cold.iterations))
+        np.testing.assert_array_equal(
+            warm.saved_iterations,
+            self.nipals.iterations[:warm.max_lv] - warm.iterations)
+        np.testing.assert_allclose(warm.B, cold.B, atol=1e-6)
+
+        fewer = model.nipals(X[:15], self.train_set.y[:15],
+                             warm_start=self.nipals)
+        np.testing.assert_allclose(
+            fewer.B, model.nipals(X[:15], self.train_set.y[:15]).B,
+            atol=1e-6)
+
+        closed = model.nipals(self.train_set.x, self.train_set.y,
+                              closed_form=True)
+        warm = model.nipals(X, self.train_set.y, warm_start=closed)
+        np.testing.assert_array_equal(warm.saved_iterations, 0)
+        self.assertRaises(ValueError, model.nipals, X[:, 1:],
+                          self.train_set.y, warm_start=self.nipals)
+
+    def test_coefficients_for_every_lv(self):
+        for engine in sorted(model.ENGINES):
+            with self.subTest(engine=engine):
+                mdl = model.fit(self.train_set.x, self.train_set.y,
+                                engine=engine)
+                B_all = mdl.B_all
+                Y_all = mdl.predict(self.train_set.x, all_lv=True)
+                self.assertEqual(B_all.shape, (mdl.m, mdl.p, mdl.max_lv))
+                self.assertEqual(Y_all.shape, (mdl.n, mdl.p, mdl.max_lv))
+                self.assertEqual(mdl.nr_lv, mdl.max_lv)
+                for lv in range(1, mdl.max_lv + 1):
+                    mdl.nr_lv = lv
+                    W1 = mdl.W.dot(np.linalg.inv(mdl.P.T.dot(mdl.W)))
+                    np.testing.assert_allclose(mdl.W1, W1, atol=1e-8)
+                    np.testing.assert_allclose(
+                        mdl.B, np.dot(W1 * mdl.b, mdl.Q.T), atol=1e-8)
+                    np.testing.assert_allclose(B_all[:, :, lv - 1], mdl.B,
+                                               atol=1e-8)
+                    np.testing.assert_allclose(Y_all[:, :, lv - 1],
+                                               mdl.Y_modeled, atol=1e-8)
+
+    def test_lv_statistics(self):
+        test_set = model.TestSet('.test_set_synthesis.csv', self.train_set)
+        y_pred_all = self.nipals.predict_all(test_set.x)
+        stats = model.LVStatistics(test_set.y, y_pred_all)
+        self.assertEqual(stats.rmsec.shape, (stats.p, self.nipals.max_lv))
+        for lv in range(1, self.nipals.max_lv + 1):
+            self.nipals.nr_lv = lv
+            single = model.Statistics(test_set.y,
+                                      self.nipals.predict(test_set.x))
+            for attr in ('ess', 'rss', 'tss', 'rmsec'):
+                with self.subTest(lv=lv, attr=attr):
+                    np.testing.assert_allclose(
+                        getattr(stats, attr)[:, lv - 1],
+                        getattr(single, attr))
+
+    def test_chunked_diagnostics(self):
+        mdl = self.nipals
+        mdl.nr_lv = 3
+        T, U, E_x = mdl.T, mdl.U, mdl.E_x
+        t_square = np.diag(T.dot(np.diag(1 / mdl.x_eigenvalues)).dot(T.T))
+        q = np.diag(E_x.dot(E_x.T))
+        leverage = np.diag(U.dot(np.linalg.inv(U.T.dot(U))).dot(U.T))
+        np.testing.assert_allclose(mdl.t_square, t_square)
+        np.testing.assert_allclose(mdl.q_residuals_x, q)
+        np.testing.assert_allclose(mdl.leverage, leverage)
+        np.testing.assert_allclose(
+            model.hotelling_t_square(T, mdl.x_eigenvalues, chunk_size=3),
+            t_square)
+        np.testing.assert_allclose(
+            model.q_residuals(mdl.X, T, mdl.P, chunk_size=3), q)
+        np.testing.assert_allclose(model.leverage(U, chunk_size=3),
+                                   leverage)
+
+    def test_properties_cached_per_lv(self):
+        mdl = self.nipals
+        mdl.nr_lv = 2
+        B, E_x = mdl.B, mdl.E_x
+        mdl.nr_lv = 3
+        self.assertIsNot(mdl.B, B)
+        np.testing.assert_allclose(mdl.B, mdl.B_all[:, :, 2])
+        mdl.nr_lv = 2
+        self.assertIs(mdl.B, B)
+        self.assertIs(mdl.E_x, E_x)
+
+        mdl.extend(0)
+        self.assertIs(mdl.B, B)
+        mdl._resize(mdl.max_lv)
+        mdl.nr_lv = 2
+        self.assertIsNot(mdl.B, B)
+
+
+class test_cross_validation(unittest.TestCase):
+
+    def setUp(self):
+        self.train_set = model.TrainingSet('.train_set_synthesis.csv')
+        self.train_set.autoscale()
+
+    def tearDown(self):
+        self.train_set = None
+
+    def test_parallel_cross_validation(self):
+        serial = model.cross_validation(self.train_set, 5, 1, 4)
+        parallel = model.cross_validation(self.train_set, 5, 1, 4, n_jobs=2)
+        for name in model.CVStatistics.ARRAYS:
+            np.testing.assert_array_equal(getattr(parallel, name),
+                                          getattr(serial, name))
+        self.assertRaises(ValueError, model.cross_validation,
+                          self.train_set, 5, 1, 4, n_jobs=0)
+
+        # without shared memory (Python < 3.8) the splits run in process
+        with mock.patch.dict(sys.modules,
+                             {'multiprocessing.shared_memory': None}):
+            fallback = model.cross_validation(self.train_set, 5, 1, 4,
+                                              n_jobs=2)
+        for name in model.CVStatistics.ARRAYS:
+            np.testing.assert_array_equal(getattr(fallback, name),
+                                          getattr(serial, name))
+
+    def test_parallel_cross_validation_spawn(self):
+        # the spawned workers import the entry script of the application,
+        # as they do when the cross-validation is started by the gui
+        entry_script = os.path.join(os.path.dirname(model.__file__),
+                                    'pls-da.py')
+        main = sys.modules['__main__']
+        with mock.patch.object(main, '__spec__', None), \
+                mock.patch.object(main, '__file__', entry_script,
+                                  create=True):
+            parallel = model.cross_validation(self.train_set, 5, 1, 4,
+                                              n_jobs=2)
+        serial = model.cross_validation(self.train_set, 5, 1, 4)
+        for name in model.CVStatistics.ARRAYS:
+            np.testing.assert_array_equal(getattr(parallel, name),
+                                          getattr(serial, name))
+
+    def test_cross_validation_fits_max_lv(self):
+        results = model.cross_validation(self.train_set, 4, 1, 3)
+        splits = model.venetian_blind_split(self.train_set, 4, 1)
+        for rss, (train, test) in zip(results.rss, splits):
+            mdl = model.nipals(*train)
+            self.assertGreater(mdl.max_lv, 3)
+            for lv in range(1, 4):
+                mdl.nr_lv = lv
+                stats = model.Statistics(test[1], mdl.predict(test[0]))
+                np.testing.assert_allclose(rss[lv - 1], stats.rss,
+                                           atol=1e-10)
+
+    def test_cross_validation_pads_missing_lv(self):
+        random_state = np.random.RandomState(0)
+        train_set = copy.copy(self.train_set)
+        train_set.x = random_state.randn(20, 100)
+        train_set.x -= train_set.x.mean(axis=0)
+        for engine in sorted(model.ENGINES):
+            with self.subTest(engine=engine):
+                # the 15 train samples of every split have rank <= 15
+                results = model.cross_validation(train_set, 4, 1, 19,
+                                                 engine=engine)
+                self.assertEqual(results.rss.shape, (4, 19, train_set.p))
+                np.testing.assert_array_equal(results.rss[:, 15:],
+                                              results.rss[:, 14:15].repeat(
+                                                  4, axis=1))
+
+    def test_leave_one_out(self):
+        n = self.train_set.n
+        fast = model.leave_one_out(self.train_set, 4)
+        slow = model.cross_validation(self.train_set, n, 1, 4,
+                                      engine='covariance')
+        self.assertEqual((fast.splits, fast.max_lv), (n, 4))
+        for name in model.CVStatistics.ARRAYS:
+            np.testing.assert_allclose(getattr(fast, name),
+                                       getattr(slow, name), atol=1e-8)
+        self.assertRaises(ValueError, model.leave_one_out, self.train_set, 0)
+
+    def test_split_plans(self):
+        n = self.train_set.n
+        categories = np.array(self.train_set.categorical_y)
+        groups = np.arange(n) // 3
+        plans = [model.venetian_blind_plan(n, 4, 2),
+                 model.contiguous_plan(n, 4),
+                 model.kfold_plan(n, 4, seed=0),
+                 model.stratified_plan(categories, 4, seed=0),
+                 model.group_plan(groups, 4)]
+        for plan in plans:
+            self.assertEqual(len(plan), 4)
+            tested = np.concatenate(plan.tests)
+            np.testing.assert_array_equal(np.sort(tested), np.arange(n))
+            for train, test in plan:
+                np.testing.assert_array_equal(
+                    np.sort(np.concatenate((train, test))), np.arange(n))
+        for test in plans[2].tests:
+            self.assertLessEqual(abs(len(test) - n / 4), 1)
+        for test in plans[3].tests:
+            for category in np.unique(categories):
+                count = np.sum(categories[test] == category)
+                expected = np.sum(categories == category) / 4
+                self.assertLessEqual(abs(count - expected), 1)
+        for test in plans[4].tests:
+            self.assertEqual(len(test), np.sum(np.isin(groups, groups[test])))
+
+        monte_carlo = model.monte_carlo_plan(n, 6, 5, seed=0)
+        self.assertEqual([len(test) for test in monte_carlo.tests], [5] * 6)
+        np.testing.assert_array_equal(
+            model.kfold_plan(n, 4, seed=1).tests[0],
+            model.kfold_plan(n, 4, seed=1).tests[0])
+
+        self.assertRaises(ValueError, model.kfold_plan, n, 1)
+        self.assertRaises(ValueError, model.monte_carlo_plan, n, 2, n)
+        self.assertRaises(ValueError, model.group_plan, [0, 0, 1], 3)
+        self.assertRaises(ValueError, model.SplitPlan, n, [[n]])
+
+    def test_cross_validation_plan(self):
+        venetian = model.cross_validation(self.train_set, 4, 2, 3)
+        planned = model.cross_validation(
+            self.train_set, None, None, 3,
+            plan=model.venetian_blind_plan(self.train_set.n, 4, 2))
+        parallel = model.cross_validation(
+            self.train_set, None, None, 3, n_jobs=2,
+            plan=model.venetian_blind_plan(self.train_set.n, 4, 2))
+        for results in (planned, parallel):
+            for name in model.CVStatistics.ARRAYS:
+                np.testing.assert_allclose(getattr(results, name),
+                                           getattr(venetian, name))
+        self.assertRaises(ValueError, model.cross_validation, self.train_set,
+                          None, None, 3, plan=model.contiguous_plan(5, 2))
+
+    def test_cv_statistics(self):
+        results = model.cross_validation(self.train_set, 4, 1, 3)
+        self.assertEqual(results.rss.shape, (4, 3, self.train_set.p))
+        rss = np.zeros((self.train_set.p, 3))
+        tss = np.zeros((self.train_set.p, 3))
+        errors = np.zeros((self.train_set.p, 3))
+        members = np.zeros(self.train_set.p)
+        splits = model.venetian_blind_split(self.train_set, 4, 1)
+        for train, test in splits:
+            mdl = model.nipals(*train, nr_lv=3)
+            y_pred_all = mdl.predict_all(test[0])
+            stats = model.LVStatistics(test[1], y_pred_all)
+            rss += stats.rss
+            tss += stats.tss
+            real = model.argmax_rule(test[1], ties='first')
+            members += np.sum(real, axis=0)
+            for lv in range(3):
+                pred = model.argmax_rule(y_pred_all[:, :, lv], ties='first')
+                errors[:, lv] += np.sum(real * (1 - pred), axis=0)
+        np.testing.assert_allclose(results.rmsecv,
+                                   np.sqrt(rss / self.train_set.n))
+        np.testing.assert_allclose(results.r_squared, 1 - rss / tss)
+        np.testing.assert_allclose(results.error_rate,
+                                   errors / members[:, np.newaxis])
+
+        with tempfile.TemporaryDirectory() as folder:
+            filename = os.path.join(folder, 'cv.npz')
+            results.save(filename)
+            loaded = model.CVStatistics.load(filename)
+        for name in model.CVStatistics.ARRAYS:
+            np.testing.assert_array_equal(getattr(loaded, name),
+                                          getattr(results, name))
+        self.assertRaises(ValueError, model.CVStatistics, results.rss,
+                          results.tss[0], results.n_test, results.errors,
+                          results.members)
+
+
+class test_classification_rules(unittest.TestCase):
+
+    Y = np.array([[0.2, 0.9, 0.1], [0.5, 0.5, 0.1], [0.7, 0.1, 0.6]])
+
+    def test_argmax_rule(self):
+        np.testing.assert_array_equal(
+            model.argmax_rule(self.Y), [[0, 1, 0], [1, 1, 0], [1, 0, 0]])
+        np.testing.assert_array_equal(
+            model.argmax_rule(self.Y, ties='first'),
+            [[0, 1, 0], [1, 0, 0], [1, 0, 0]])
+        np.testing.assert_array_equal(
+            model.argmax_rule(self.Y, ties='none'),
+            [[0, 1, 0], [0, 0, 0], [1, 0, 0]])
+        self.assertRaises(ValueError, model.argmax_rule, self.Y, ties='?')
+
+    def test_threshold_rule(self):
+        np.testing.assert_array_equal(
+            model.threshold_rule(self.Y), [[0, 1, 0], [1, 1, 0], [1, 0, 1]])
+        np.testing.assert_array_equal(
+            model.threshold_rule(self.Y, [0.8, 0.4, 0.6]),
+            [[0, 1, 0], [0, 1, 0], [0, 0, 1]])
+
+    def test_bayesian_thresholds(self):
+        random_state = np.random.RandomState(0)
+        Y_real = np.repeat(np.eye(2), 500, axis=0)
+        Y_pred = Y_real + random_state.randn(1000, 2) / 5
+        np.testing.assert_allclose(
+            model.bayesian_thresholds(Y_pred, Y_real), 0.5, atol=0.05)
+
+    def test_Y_modeled_dummy(self):
+        train_set = model.TrainingSet('.train_set_synthesis.csv')
+        train_set.autoscale()
+        mdl = model.nipals(train_set.x, train_set.y, nr_lv=2)
+        np.testing.assert_array_equal(mdl.Y_modeled_dummy,
+                                      model.argmax_rule(mdl.Y_modeled))
+
+
 if __name__ == '__main__':
 
     create_environment()
@@ -5,6 +5,7 @@ import argparse
 import matplotlib.pyplot as plt
 import numpy as np
 import os
+import tempfile
 import unittest
 
 from context import IO
@@ -73,6 +74,20 @@ class test_IO_module(unittest.TestCase):
     def test_load(self):
         pass
 
+    def test_load_split_plan(self):
+        train_set = model.TrainingSet('.train_set_synthesis.csv')
+        plot.update_global_train_set(train_set)
+        plot.update_global_model(model.nipals(train_set.x, train_set.y))
+        plan = model.kfold_plan(train_set.n, 3, seed=0)
+        with tempfile.TemporaryDirectory() as workspace:
+            IO.dump(workspace, 3, 1)
+            self.assertIsNone(IO.load_split_plan(workspace))
+            IO.dump(workspace, 3, 1, plan)
+            loaded = IO.load_split_plan(workspace)
+        self.assertEqual(loaded.n, plan.n)
+        for loaded_test, test in zip(loaded.tests, plan.tests):
+            np.testing.assert_array_equal(loaded_test, test)
+
 
 class test_plot_module(unittest.TestCase):
 
@@ -197,7 +212,32 @@ class test_utility_module(unittest.TestCase):
         pass
 
     def test_cached_property(self):
-        pass
+
+        class Cached(object):
+            size = 10
+
+            @utility.cached_property(key=lambda obj: obj.size)
+            def array(self):
+                return np.zeros(self.size)
+
+        obj = Cached()
+        array = obj.array
+        self.assertIs(obj.array, array)
+        obj.size = 20
+        self.assertIsNot(obj.array, array)
+        obj.size = 10
+        self.assertIs(obj.array, array)
+        info = utility.cache_info(obj)
+        self.assertEqual((info.hits, info.misses, info.evictions), (2, 2, 0))
+        self.assertEqual(info.nbytes, 30 * array.itemsize)
+
+        utility.set_cache_budget(obj, 25 * array.itemsize)
+        self.assertFalse(utility.is_property_cached(obj, 'array', 20))
+        self.assertTrue(utility.is_property_cached(obj, 'array', 10))
+        self.assertEqual(utility.cache_info(obj).evictions, 1)
+
+        utility.clear_property_cache(obj)
+        self.assertEqual(utility.cache_info(obj).nbytes, 0)
 
 
 if __name__ == '__main__':
@@ -25,6 +25,7 @@ __license__ = "GPL3"
 
 
 import argparse
+import collections
 from functools import update_wrapper
 
 
@@ -102,46 +103,142 @@ class CLI(object):
 _CLASS_CACHE_ATTR_NAME = '_class_cached_properties'
 _OBJ_CACHE_ATTR_NAME = '_cached_properties'
 
+# default bytes that every object can cache, the least recently used values
+# are evicted above it (see set_cache_budget)
+CACHE_MAX_BYTES = 256 * 2**20
+
+CacheInfo = collections.namedtuple(
+    'CacheInfo', ('hits', 'misses', 'evictions', 'entries', 'nbytes',
+                  'max_bytes'))
+
+
+class _PropertyCache(object):
+    """LRU cache of the properties of an object, with size accounting."""
+
+    def __init__(self):
+        self.values = collections.OrderedDict()
+        self.sizes = dict()
+        self.nbytes = 0
+        self.max_bytes = None  # None means CACHE_MAX_BYTES
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, key):
+        return key in self.values
+
+    def __iter__(self):
+        return iter(list(self.values))
+
+    @property
+    def budget(self):
+        return CACHE_MAX_BYTES if self.max_bytes is None else self.max_bytes
+
+    def get(self, key):
+        """Return (True, value) and mark it as recently used, or
+           (False, None) if key is not cached."""
+        if key not in self.values:
+            self.misses += 1
+            return False, None
+        self.hits += 1
+        self.values.move_to_end(key)
+        return True, self.values[key]
+
+    def put(self, key, value):
+        """Cache value, evicting the least recently used values if the
+           budget is exceeded."""
+        self.pop(key)
+        self.values[key] = value
+        self.sizes[key] = _nbytes(value)
+        self.nbytes += self.sizes[key]
+        self.shrink()
+
+    def pop(self, key):
+        """Forget the value of key, if any."""
+        if key in self.values:
+            del self.values[key]
+            self.nbytes -= self.sizes.pop(key)
+
+    def shrink(self):
+        """Evict the least recently used values above the budget."""
+        while self.nbytes > self.budget and self.values:
+            self.pop(next(iter(self.values)))
+            self.evictions += 1
+
+
+def _nbytes(value):
+    """Return the bytes of numpy arrays (or of lists and tuples of them)."""
+    if isinstance(value, (list, tuple)):
+        return sum(_nbytes(item) for item in value)
+    return getattr(value, 'nbytes', 0)
+
+
+def cached_property(fn=None, key=None):
+    """Cache the value of a property in its object.
+
+       key is an optional function of the object whose result is part of
+       the cache key, e.g. operator.attrgetter('nr_lv') keeps a value for
+       every number of latent variables. It can be used as
+       @cached_property or as @cached_property(key=...).
+    """
+    if fn is None:
+        return lambda fn: cached_property(fn, key)
 
-def cached_property(fn):
     def _cached_property(self):
-        return _get_property_value(fn, self, _OBJ_CACHE_ATTR_NAME)
+        return _get_property_value(fn, self, _OBJ_CACHE_ATTR_NAME, key=key)
     return property(update_wrapper(_cached_property, fn))
 
 
-def set_property_cache(obj, name, value):
+def set_property_cache(obj, name, value, key=None):
+    _update_cache(obj, _OBJ_CACHE_ATTR_NAME, (name, key), value)
+
+
+def clear_property_cache(obj, name=None):
+    """Forget the cached values of name (for any key), or all of them."""
+    cache = _get_cache(obj)
+    for cache_key in cache:
+        if name is None or cache_key[0] == name:
+            cache.pop(cache_key)
+
+
+def is_property_cached(obj, name, key=None):
     cache = _get_cache(obj)
-    cache[name] = value
-    setattr(obj, _OBJ_CACHE_ATTR_NAME, cache)
+    return (name, key) in cache
 
 
-def clear_property_cache(obj, name):
+def set_cache_budget(obj, max_bytes):
+    """Set the bytes obj can cache (None restores CACHE_MAX_BYTES)."""
     cache = _get_cache(obj)
-    if name in cache:
-        del cache[name]
+    cache.max_bytes = max_bytes
+    cache.shrink()
 
 
-def is_property_cached(obj, name):
+def cache_info(obj):
+    """Return the CacheInfo of hits, misses, evictions, number of entries,
+       bytes and budget of the cached properties of obj."""
     cache = _get_cache(obj)
-    return name in cache
+    return CacheInfo(cache.hits, cache.misses, cache.evictions,
+                     len(cache.values), cache.nbytes, cache.budget)
 
 
 def _get_cache(obj, cache_attr_name=_OBJ_CACHE_ATTR_NAME):
-    return getattr(obj, cache_attr_name, {})
+    if cache_attr_name not in vars(obj):
+        setattr(obj, cache_attr_name, _PropertyCache())
+    return getattr(obj, cache_attr_name)
 
 
 def _update_cache(obj, cache_attr_name, cache_key, result):
-    cache = _get_cache(obj, cache_attr_name)
-    cache[cache_key] = result
-    setattr(obj, cache_attr_name, cache)
+    _get_cache(obj, cache_attr_name).put(cache_key, result)
 
 
-def _get_property_value(fn, obj, cache_attr_name, cache_false_results=True):
+def _get_property_value(fn, obj, cache_attr_name, cache_false_results=True,
+                        key=None):
     cache = _get_cache(obj, cache_attr_name)
-    cache_key = fn.__name__
+    cache_key = (fn.__name__, None if key is None else key(obj))
 
-    if cache_key in cache:
-        return cache[cache_key]
+    cached, value = cache.get(cache_key)
+    if cached:
+        return value
 
     result = fn(obj)
     if result is not None or cache_false_results: